@@ -6,41 +6,136 @@ Code stream utilities
 This file is released under the GNU GPL version 3 or later.
 """
 
-from functools import partial
 import string
-import io
+import re
 
 from . import error
 from . import tokens as tk
 
 
-class CodeStream(io.BytesIO):
+# compiled patterns that find the first of a set of characters, by tuple of characters
+_scanners = {}
+
+def _scanner(chars):
+    """Get a compiled pattern that finds the first of a tuple of characters."""
+    try:
+        return _scanners[chars]
+    except KeyError:
+        pattern = re.compile(b'[%s]' % b''.join(re.escape(c) for c in set(chars) if c))
+        return _scanners.setdefault(chars, pattern)
+
+
+class CodeStream(object):
     """Stream of various kinds of code."""
 
+    # The code is kept in a bytearray and read through an integer cursor.
+    # Reads slice an immutable copy of the buffer, which is refreshed on the first read after a write.
+    # This has the semantics of io.BytesIO, which it replaces, for the calls used here.
+
     # whitespace
     blanks = ' \t\n'
     # line end characters for ths stream type
     end_line = None
 
+    def __init__(self, initial_bytes=b''):
+        """Initialise the stream."""
+        self._buffer = bytearray(initial_bytes)
+        self._code = bytes(self._buffer)
+        self._pos = 0
+
+    def __getstate__(self):
+        """Pickle."""
+        pickle_dict = self.__dict__.copy()
+        # the immutable copy can be rebuilt
+        pickle_dict['_code'] = None
+        return pickle_dict
+
+    def _get_code(self):
+        """Get the code as an immutable byte string."""
+        if self._code is None:
+            self._code = bytes(self._buffer)
+        return self._code
+
+    # file-like interface
+
+    def read(self, n=-1):
+        """Read n chars, or up to the end if n is negative."""
+        code = self._code if self._code is not None else self._get_code()
+        pos = self._pos
+        if n is None or n < 0:
+            d = code[pos:]
+        else:
+            d = code[pos:pos+n]
+        self._pos = pos + len(d)
+        return d
+
+    def write(self, s):
+        """Write at the current position, padding with NULs if beyond the end."""
+        pos = self._pos
+        if not s:
+            return 0
+        if pos > len(self._buffer):
+            self._buffer.extend(b'\0' * (pos - len(self._buffer)))
+        self._buffer[pos:pos+len(s)] = s
+        self._pos = pos + len(s)
+        self._code = None
+        return len(s)
+
+    def seek(self, pos, whence=0):
+        """Move the cursor; relative moves stop at the start of the stream."""
+        if whence == 0:
+            if pos < 0:
+                raise ValueError('negative seek value %d' % pos)
+        elif whence == 1:
+            pos = max(0, self._pos + pos)
+        else:
+            pos = max(0, len(self._buffer) + pos)
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        """Get the cursor position."""
+        return self._pos
+
+    def truncate(self, size=None):
+        """Cut off the stream at the given size or the current position."""
+        if size is None:
+            size = self._pos
+        if size < len(self._buffer):
+            del self._buffer[size:]
+            self._code = None
+        return size
+
+    def getvalue(self):
+        """Get the contents of the stream."""
+        return self._get_code()
+
+    # code parsing
+
     def peek(self, n=1):
         """Peek next char in stream."""
-        d = self.read(n)
-        self.seek(-len(d), 1)
-        return d
+        code = self._code if self._code is not None else self._get_code()
+        return code[self._pos:self._pos+n]
 
     def skip_read(self, skip_range, n=1):
         """Skip chars in skip_range, then read next."""
-        while True:
-            d = self.read(1)
-            # skip_range must not include ''
-            if d == '' or d not in skip_range:
-                return d + self.read(n-1)
+        code = self._code if self._code is not None else self._get_code()
+        pos, size = self._pos, len(code)
+        # skip_range must not include ''
+        while pos < size and code[pos] in skip_range:
+            pos += 1
+        d = code[pos:pos+n]
+        self._pos = pos + len(d)
+        return d
 
     def skip(self, skip_range, n=1):
         """Skip chars in skip_range, then peek next."""
-        d = self.skip_read(skip_range, n)
-        self.seek(-len(d), 1)
-        return d
+        code = self._code if self._code is not None else self._get_code()
+        pos, size = self._pos, len(code)
+        while pos < size and code[pos] in skip_range:
+            pos += 1
+        self._pos = pos
+        return code[pos:pos+n]
 
     def skip_blank_read(self, n=1):
         """Skip whitespace, then read next."""
@@ -48,9 +143,7 @@ class CodeStream(io.BytesIO):
 
     def skip_blank(self, n=1):
         """Skip whitespace, then peek next."""
-        d = self.skip_read(self.blanks, n)
-        self.seek(-len(d), 1)
-        return d
+        return self.skip(self.blanks, n)
 
     def backskip_blank(self):
         """Skip whitespace backwards, then peek next."""
@@ -64,7 +157,7 @@ class CodeStream(io.BytesIO):
     def read_if(self, d, in_range):
         """Read if next char is not empty and in range."""
         if d != '' and d in in_range:
-            self.read(len(d))
+            self._pos += len(d)
             return d
         return None
 
@@ -74,34 +167,30 @@ class CodeStream(io.BytesIO):
 
     def read_to(self, findrange):
         """Read until a character from a given range is found."""
-        out = ''
-        while True:
-            d = self.read(1)
-            if d == '':
-                break
-            if d in findrange:
-                break
-            out += d
-        self.seek(-len(d), 1)
-        return out
+        code = self._code if self._code is not None else self._get_code()
+        pos = self._pos
+        match = _scanner(findrange).search(code, pos)
+        end = match.start() if match else max(pos, len(code))
+        self._pos = end
+        return code[pos:end]
 
     def read_name(self):
         """Read a variable name."""
-        d = self.skip_blank_read()
+        d = self.skip_blank()
         if not d or d not in string.ascii_letters:
             # variable name must start with a letter
-            self.seek(-len(d), 1)
             return ''
-        name = ''
-        while d in tk.NAME_CHARS:
-            name += d
-            d = self.read(1)
+        code = self._code
+        start = pos = self._pos
+        size = len(code)
+        while pos < size and code[pos] in tk.NAME_CHARS:
+            pos += 1
         # only the first 40 chars are relevant in GW-BASIC, rest is discarded
-        name = name[:40]
-        if d in tk.SIGILS:
-            name += d
-        else:
-            self.seek(-len(d), 1)
+        name = code[start:pos][:40]
+        if pos < size and code[pos] in tk.SIGILS:
+            name += code[pos]
+            pos += 1
+        self._pos = pos
         # names are not case sensitive
         return name.upper()
 
@@ -125,13 +214,10 @@ class CodeStream(io.BytesIO):
 
     def require_read(self, in_range, err=error.STX):
         """Skip whitespace, read and raise error if not in range."""
-        d = self.read(1)
-        while d and d in self.blanks:
-            d = self.read(1)
-        c = d + self.read(len(in_range[0])-1)
+        c = self.skip_blank(len(in_range[0]))
         if not c or c not in in_range:
-            self.seek(-len(c), 1)
             raise error.BASICError(err)
+        self._pos += len(c)
         return c
 
     def _read_dec(self):
@@ -227,6 +313,19 @@ class CodeStream(io.BytesIO):
         return word
 
 
+# compiled patterns that find the next char that skip_to needs to look at, by findrange
+_skip_scanners = {}
+
+def _skip_scanner(findrange):
+    """Get a compiled pattern for skip_to."""
+    try:
+        return _skip_scanners[findrange]
+    except KeyError:
+        # literals, comments, line headers, tokens with trailing bytes and the chars we look for
+        chars = ('"', tk.REM, '\0') + tuple(tk.PLUS_BYTES) + tuple(token[:1] for token in findrange)
+        return _skip_scanners.setdefault(findrange, _scanner(chars))
+
+
 class TokenisedStream(CodeStream):
     """Stream of tokenised BASIC code."""
 
@@ -234,8 +333,38 @@ class TokenisedStream(CodeStream):
 
     def __init__(self, addr=None):
         """Initialise tokenised stream."""
+        CodeStream.__init__(self)
         # memory address, if any
         self._addr = addr
+        # pre-decoded code objects by kind, each keyed by stream position
+        # kinds are names, or the findrange tuple for skip_to
+        self._caches = {}
+
+    def __getstate__(self):
+        """Pickle."""
+        pickle_dict = CodeStream.__getstate__(self)
+        # pre-decoded code may hold unpicklable callables
+        pickle_dict['_caches'] = {}
+        return pickle_dict
+
+    def get_cache(self, kind):
+        """Get the cache of pre-decoded code of a given kind, keyed by position."""
+        try:
+            return self._caches[kind]
+        except KeyError:
+            return self._caches.setdefault(kind, {})
+
+    def write(self, s):
+        """Write to the stream, invalidating any pre-decoded code."""
+        if self._caches:
+            self._caches.clear()
+        return CodeStream.write(self, s)
+
+    def truncate(self, size=None):
+        """Truncate the stream, invalidating any pre-decoded code."""
+        if self._caches:
+            self._caches.clear()
+        return CodeStream.truncate(self, size)
 
     def tell_address(self):
         """Get memory address for current stream position."""
@@ -245,14 +374,38 @@ class TokenisedStream(CodeStream):
 
     def skip_to(self, findrange, break_on_first_char=True):
         """Skip until character is in findrange."""
+        if not break_on_first_char:
+            return self._scan_to(findrange, break_on_first_char)
+        # where we end up depends only on the code and where we start;
+        # keep a table of statement (or other) boundaries by start position for each findrange
+        ends = self.get_cache(findrange)
+        pos = self._pos
+        try:
+            self._pos = ends[pos]
+        except KeyError:
+            self._scan_to(findrange, break_on_first_char)
+            ends[pos] = self._pos
+
+    def _scan_to(self, findrange, break_on_first_char):
+        """Scan the code until character is in findrange."""
+        code = self._code if self._code is not None else self._get_code()
+        scanner = _skip_scanner(findrange)
         literal = False
         rem = False
         nchars = len(findrange[0])
+        pos = self._pos
         while True:
-            c = self.read(1)
-            if c == '':
+            # jump to the next char that has any effect
+            match = scanner.search(code, pos)
+            if not match:
+                pos = max(pos, len(code))
                 break
-            elif c == '"':
+            if match.start() > pos and not (literal or rem):
+                break_on_first_char = True
+            pos = match.start()
+            c = code[pos]
+            pos += 1
+            if c == '"':
                 literal = not literal
             elif c == tk.REM:
                 rem = True
@@ -261,21 +414,23 @@ class TokenisedStream(CodeStream):
                 rem = False
             if literal or rem:
                 continue
-            if c + self.peek(nchars-1) in findrange:
+            if c + code[pos:pos+nchars-1] in findrange:
                 if break_on_first_char:
-                    self.seek(-1, 1)
+                    pos -= 1
                     break
             break_on_first_char = True
             # not elif! if not break_on_first_char, c needs to be properly processed.
             if c == '\0':
                 # offset and line number follow
                 literal = False
-                off = self.read(2)
+                off = code[pos:pos+2]
+                pos += len(off)
                 if len(off) < 2 or off == '\0\0':
                     break
-                self.read(2)
+                pos = min(pos + 2, len(code))
             elif c in tk.PLUS_BYTES:
-                self.read(tk.PLUS_BYTES[c])
+                pos = min(pos + tk.PLUS_BYTES[c], len(code))
+        self._pos = pos
 
     def skip_to_read(self, findrange):
         """Skip until character is in findrange, then read."""
@@ -284,27 +439,28 @@ class TokenisedStream(CodeStream):
 
     def read_keyword_token(self):
         """Read full keyword token."""
-        token = self.read(1)
+        code = self._code if self._code is not None else self._get_code()
+        pos = self._pos
+        token = code[pos:pos+1]
         if token in ('\xff', '\xfe', '\xfd'):
-            token += self.read(1)
+            token = code[pos:pos+2]
+        self._pos = pos + len(token)
         return token
 
     def read_number_token(self):
         """Read full token, including trailing bytes."""
-        lead = self.read(1)
+        code = self._code if self._code is not None else self._get_code()
+        pos = self._pos
+        lead = code[pos:pos+1]
         if lead not in tk.NUMBER:
-            self.seek(-len(lead), 1)
             return ''
-        trail = self.read(tk.PLUS_BYTES.get(lead, 0))
-        return lead + trail
+        token = code[pos:pos+1+tk.PLUS_BYTES.get(lead, 0)]
+        self._pos = pos + len(token)
+        return token
 
     def require_end(self, err=error.STX):
         """Skip whitespace, peek and raise error if not at end of statement."""
-        d = self.read(1)
-        while d and d in self.blanks:
-            d = self.read(1)
-        self.seek(-len(d), 1)
-        if d not in tk.END_STATEMENT:
+        if self.skip_blank() not in tk.END_STATEMENT:
             raise error.BASICError(err)
 
     def skip_to_token(self, requested_token):
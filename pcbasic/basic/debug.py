@@ -278,3 +278,22 @@ class Debugger(BaseDebugger):
         """Write a marked-up hex dump of the program to the log."""
         for s in self._repr_program().split('\n'):
             logging.debug(s)
+
+    def showmemory(self):
+        """Write the sizes of the data segment areas to the log."""
+        memory = self._session.memory
+        logging.debug(
+            '%i bytes free: code %i, scalars %i, arrays %i, strings %i' % (
+                memory.get_free(), memory.program.size(), memory.scalars.current,
+                memory.arrays.current, memory.stack_start() - memory.strings.current))
+
+    def showloops(self):
+        """Write statistics of compiled FOR loops to the log."""
+        compiler = self._session.interpreter.loop_compiler
+        if not compiler:
+            logging.debug('Loop compilation is not enabled.')
+            return
+        for stats in compiler.get_stats():
+            logging.debug(
+                '[%i] %i statements compiled, %i interpreted and %i compiled iterations, '
+                '%i entries, %i fallbacks' % stats)
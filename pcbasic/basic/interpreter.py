@@ -13,13 +13,14 @@ from .base import error
 from .base import tokens as tk
 from .base import codestream
 from . import values
+from . import loops
 
 
 class Interpreter(object):
     """BASIC interpreter."""
 
     def __init__(self, debugger, input_methods, screen, devices, sound,
-                values, memory, scalars, program, parser, basic_events):
+                values, memory, scalars, program, parser, basic_events, compile_loops=0):
         """Initialise interpreter."""
         self._debugger = debugger
         self._input_methods = input_methods
@@ -42,6 +43,13 @@ class Interpreter(object):
         self.tron = False
         # pointer position: False for direct line, True for program
         self.run_mode = False
+        # compiler for frequently run FOR loops, if enabled
+        self.loop_compiler = None
+        if compile_loops:
+            self.loop_compiler = loops.LoopCompiler(
+                    compile_loops, self, program, parser, memory, input_methods, basic_events)
+        # a program compiled ahead of time has been attached
+        self._compiled = False
         # clear stacks
         self.clear_stacks_and_pointers()
         self._init_error_trapping()
@@ -71,6 +79,17 @@ class Interpreter(object):
             try:
                 self.handle_basic_events()
                 ins = self.get_codestream()
+                if self._hot_loop:
+                    # continue a frequently run FOR loop in compiled code
+                    loop, self._hot_loop = self._hot_loop, None
+                    if self.loop_compiler.run(loop, ins):
+                        continue
+                if self._compiled and self.run_mode and not self._basic_events.enabled:
+                    # run the program line from here in compiled code, if available
+                    entry = ins.get_cache('compiled').get(ins.tell())
+                    if entry:
+                        entry[0](entry[1])
+                        continue
                 self.current_statement = ins.tell()
                 c = ins.skip_blank_read()
                 # parse line number or : at start of statement
@@ -87,16 +106,26 @@ class Interpreter(object):
                         # stream has ended
                         self.set_pointer(False)
                         return
-                    if self.tron:
-                        linenum = struct.unpack_from('<H', token, 2)
-                        self._screen.write('[%i]' % linenum)
-                    self._debugger.debug_step(token)
+                    self.step_line(token)
                 elif c != ':':
                     ins.seek(-len(c), 1)
                 self.parser.parse_statement(ins)
             except error.BASICError as e:
                 self.trap_error(e)
 
+    def attach_compiled(self, entries):
+        """Run statements in compiled code, given as line function and index by code position."""
+        # the entries are dropped when the program changes
+        self._program_code.get_cache('compiled').update(entries)
+        self._compiled = True
+
+    def step_line(self, token):
+        """Trace and debug on entering a program line."""
+        if self.tron:
+            linenum = struct.unpack_from('<H', token, 2)
+            self._screen.write('[%i]' % linenum)
+        self._debugger.debug_step(token)
+
     def loop(self):
         """Run commands until control returns to user."""
         if not self._parse_mode:
@@ -176,6 +205,8 @@ class Interpreter(object):
         """Clear loop stacks."""
         self.for_stack = []
         self.while_stack = []
+        # FOR loop to be continued in compiled code
+        self._hot_loop = None
 
     ###########################################################################
     # event and error handling
@@ -310,30 +341,41 @@ class Interpreter(object):
         val = values.to_single(next(args))
         if val.is_zero():
             # find corrrect ELSE block, if any
-            # ELSEs may be nested in the THEN clause
             ins = self.get_codestream()
-            nesting_level = 0
-            while True:
-                d = ins.skip_to_read(tk.END_STATEMENT + (tk.IF,))
-                if d == tk.IF:
-                    # nesting step on IF. (it's less convenient to count THENs
-                    # because they could be THEN or GOTO)
-                    nesting_level += 1
-                elif d == ':':
-                    # :ELSE is ELSE; may be whitespace in between. no : means it's ignored.
-                    if ins.skip_blank_read_if((tk.ELSE,)):
-                        if nesting_level > 0:
-                            nesting_level -= 1
-                        else:
-                            # read line number or continue execution
-                            break
-                else:
-                    ins.seek(-len(d), 1)
-                    break
+            # the branch target is looked up only once for each IF
+            else_index = ins.get_cache('else')
+            thenpos = ins.tell()
+            try:
+                ins.seek(else_index[thenpos])
+            except KeyError:
+                self._skip_to_else(ins)
+                else_index[thenpos] = ins.tell()
         branch, = args
         # we may have a line number immediately after THEN or ELSE
         if branch is not None:
             self.jump(branch)
+
+    def _skip_to_else(self, ins):
+        """Helper function for IF: skip to matching ELSE clause or end of line."""
+        # ELSEs may be nested in the THEN clause
+        nesting_level = 0
+        while True:
+            d = ins.skip_to_read(tk.END_STATEMENT + (tk.IF,))
+            if d == tk.IF:
+                # nesting step on IF. (it's less convenient to count THENs
+                # because they could be THEN or GOTO)
+                nesting_level += 1
+            elif d == ':':
+                # :ELSE is ELSE; may be whitespace in between. no : means it's ignored.
+                if ins.skip_blank_read_if((tk.ELSE,)):
+                    if nesting_level > 0:
+                        nesting_level -= 1
+                    else:
+                        # read line number or continue execution
+                        break
+            else:
+                ins.seek(-len(d), 1)
+                break
         # otherwise continue parsing as normal from next statement after THEN
         # note that any :ELSE block encountered will be ignored automatically
         # since standalone ELSE is a no-op to end of line
@@ -391,26 +433,41 @@ class Interpreter(object):
     def _find_next(self, ins, varname):
         """Helper function for FOR: find matching NEXT."""
         endforpos = ins.tell()
-        ins.skip_block(tk.FOR, tk.NEXT, allow_comma=True)
-        if ins.skip_blank() not in (tk.NEXT, ','):
-            # FOR without NEXT marked with FOR line number
-            ins.seek(endforpos)
-            raise error.BASICError(error.FOR_WITHOUT_NEXT)
-        comma = (ins.read(1) == ',')
+        # the matching NEXT is looked up only once for each FOR
+        next_index = ins.get_cache('next')
+        try:
+            comma, name, nextpos = next_index[endforpos]
+        except KeyError:
+            comma, name, nextpos = next_index[endforpos] = self._scan_next(ins)
         # check var name for NEXT
         # no-var only allowed in standalone NEXT
-        if ins.skip_blank() not in tk.END_STATEMENT:
-            varname2 = self._memory.complete_name(self.parser.parse_name(ins))
+        if name is not None:
+            varname2 = self._memory.complete_name(name)
         else:
             varname2 = None
-        # get position and line number just after the matching variable in NEXT
-        nextpos = ins.tell()
         if (comma or varname2) and varname2 != varname:
             # NEXT without FOR marked with NEXT line number, while we're only at FOR
+            ins.seek(nextpos)
             raise error.BASICError(error.NEXT_WITHOUT_FOR)
         ins.seek(endforpos)
         return endforpos, nextpos
 
+    def _scan_next(self, ins):
+        """Helper function for FOR: scan for matching NEXT and read its variable name."""
+        endforpos = ins.tell()
+        ins.skip_block(tk.FOR, tk.NEXT, allow_comma=True)
+        if ins.skip_blank() not in (tk.NEXT, ','):
+            # FOR without NEXT marked with FOR line number
+            ins.seek(endforpos)
+            raise error.BASICError(error.FOR_WITHOUT_NEXT)
+        comma = (ins.read(1) == ',')
+        if ins.skip_blank() not in tk.END_STATEMENT:
+            name = self.parser.parse_name(ins)
+        else:
+            name = None
+        # get position and line number just after the matching variable in NEXT
+        return comma, name, ins.tell()
+
     def next_(self, args):
         """Iterate a loop (NEXT)."""
         for varname in args:
@@ -446,6 +503,8 @@ class Interpreter(object):
             self.for_stack.pop()
         else:
             ins.seek(forpos)
+            if self.loop_compiler and self.run_mode and not self._basic_events.enabled:
+                self._hot_loop = self.loop_compiler.count(ins, forpos, nextpos)
         return not loop_ends
 
     def while_(self, args):
@@ -461,13 +520,18 @@ class Interpreter(object):
         """Helper function for WHILE: find matching WEND."""
         # just after WHILE token
         whilepos = ins.tell()
-        ins.skip_block(tk.WHILE, tk.WEND)
-        if ins.read(1) != tk.WEND:
-            # WHILE without WEND
-            ins.seek(whilepos)
-            raise error.BASICError(error.WHILE_WITHOUT_WEND)
-        ins.skip_to(tk.END_STATEMENT)
-        wendpos = ins.tell()
+        # the matching WEND is looked up only once for each WHILE
+        wend_index = ins.get_cache('wend')
+        try:
+            wendpos = wend_index[whilepos]
+        except KeyError:
+            ins.skip_block(tk.WHILE, tk.WEND)
+            if ins.read(1) != tk.WEND:
+                # WHILE without WEND
+                ins.seek(whilepos)
+                raise error.BASICError(error.WHILE_WITHOUT_WEND)
+            ins.skip_to(tk.END_STATEMENT)
+            wendpos = wend_index[whilepos] = ins.tell()
         ins.seek(whilepos)
         return whilepos, wendpos
 
@@ -517,55 +581,75 @@ class Interpreter(object):
 
     def read_(self, args):
         """READ: read values from DATA statement."""
-        data_error = False
+        # DATA items are parsed only once for each data pointer position
+        data_index = self._program_code.get_cache('data')
         for name, indices in args:
             name = self._memory.complete_name(name)
+            is_string = name[-1] == values.STR
             current = self._program_code.tell()
-            self._program_code.seek(self.data_pos)
-            if self._program_code.peek() in tk.END_STATEMENT:
-                # initialise - find first DATA
-                self._program_code.skip_to_token(tk.DATA,)
-            if self._program_code.read(1) not in (tk.DATA, ','):
+            try:
+                item = data_index[self.data_pos, is_string]
+            except KeyError:
+                item = data_index[self.data_pos, is_string] = self._read_data_item(is_string)
+            if item is None:
                 self._program_code.seek(current)
                 raise error.BASICError(error.OUT_OF_DATA)
-            self._program_code.skip_blank()
-            if name[-1] == values.STR:
-                # for unquoted strings, payload starts at the first non-empty character
-                address = self._program_code.tell_address()
-                word = self._program_code.read_to((',', '"',) + tk.END_STATEMENT)
-                if self._program_code.peek() == '"':
-                    if word == '':
-                        # nothing before the quotes, so this is a quoted string literal
-                        # string payload starts after quote
-                        address = self._program_code.tell_address() + 1
-                        word = self._program_code.read_string().strip('"')
-                    else:
-                        # complete unquoted string literal
-                        word += self._program_code.read_string()
-                    if (self._program_code.skip_blank() not in (tk.END_STATEMENT + (',',))):
-                        raise error.BASICError(error.STX)
-                else:
-                    word = word.strip(self._program_code.blanks)
+            word, address, data_pos, data_error = item
+            self._program_code.seek(data_pos)
+            if is_string:
+                if data_error:
+                    raise error.BASICError(error.STX)
                 value = self._values.from_str_at(word, address)
             else:
-                word = self._program_code.read_number()
-                if word is None:
-                    word = ''
                 value = self._values.from_repr(word, allow_nonnum=False)
-                # anything after the number is a syntax error, but assignment has taken place)
-                if (self._program_code.skip_blank() not in (tk.END_STATEMENT + (',',))):
-                    data_error = True
             # restore to current program location
             # to ensure any other errors in set_variable get the correct line number
-            data_pos = self._program_code.tell()
             self._program_code.seek(current)
             self._memory.set_variable(name, indices, value=value)
             if data_error:
+                # anything after the number is a syntax error, but assignment has taken place
                 self._program_code.seek(self.data_pos)
                 raise error.BASICError(error.STX)
             else:
                 self.data_pos = data_pos
 
+    def _read_data_item(self, is_string):
+        """Helper function for READ: parse the DATA item at the data pointer."""
+        # returns the item's literal, its address if a string, the position after it
+        # and whether it is followed by a syntax error; None if out of data
+        ins = self._program_code
+        ins.seek(self.data_pos)
+        if ins.peek() in tk.END_STATEMENT:
+            # initialise - find first DATA
+            ins.skip_to_token(tk.DATA,)
+        if ins.read(1) not in (tk.DATA, ','):
+            return None
+        ins.skip_blank()
+        if is_string:
+            # for unquoted strings, payload starts at the first non-empty character
+            address = ins.tell_address()
+            word = ins.read_to((',', '"',) + tk.END_STATEMENT)
+            if ins.peek() == '"':
+                if word == '':
+                    # nothing before the quotes, so this is a quoted string literal
+                    # string payload starts after quote
+                    address = ins.tell_address() + 1
+                    word = ins.read_string().strip('"')
+                else:
+                    # complete unquoted string literal
+                    word += ins.read_string()
+                if (ins.skip_blank() not in (tk.END_STATEMENT + (',',))):
+                    return word, address, ins.tell(), True
+            else:
+                word = word.strip(ins.blanks)
+            return word, address, ins.tell(), False
+        else:
+            word = ins.read_number()
+            if word is None:
+                word = ''
+            data_error = ins.skip_blank() not in (tk.END_STATEMENT + (',',))
+            return word, None, ins.tell(), data_error
+
     ###########################################################################
     # COMMON
 
@@ -0,0 +1,267 @@
+"""
+PC-BASIC - loops.py
+Compilation of frequently run FOR loops
+
+(c) 2013--2018 Rob Hagemans
+This file is released under the GNU GPL version 3 or later.
+"""
+
+from .base import error
+from .base import tokens as tk
+from . import values
+
+
+# Once the body of a FOR loop has been interpreted a given number of times,
+# its statements are compiled to closures, keyed by the code position at which the
+# interpreter would start each statement. The closures move the code stream exactly as
+# the interpreter does and evaluate through the same expression trees and value classes,
+# so results and error positions are the same. Statements that can't be compiled and jumps
+# out of the loop body leave the stream at the position reached and return control to
+# the interpreter, which re-enters the compiled loop on the next interpreted NEXT.
+
+
+class _Loop(object):
+    """Compiled statements and statistics for a FOR loop."""
+
+    def __init__(self, forpos, nextpos):
+        """Set up the loop record."""
+        # code positions after the FOR statement and after the NEXT variable
+        self.forpos = forpos
+        self.nextpos = nextpos
+        # compiled statements by code position; None if not supported
+        self.ops = {}
+        # variable slot version for which the statements were compiled
+        self.version = None
+        # FOR record and view on the loop variable, set when entering
+        self.record = None
+        self.counter = None
+        # number of iterations run by the interpreter and by compiled code
+        self.count = 0
+        self.compiled = 0
+        # number of times compiled code was entered and left before the loop ended
+        self.entries = 0
+        self.fallbacks = 0
+
+    def __getstate__(self):
+        """Pickle without the compiled statements."""
+        pickle_dict = self.__dict__.copy()
+        pickle_dict['ops'] = {}
+        pickle_dict['version'] = None
+        pickle_dict['counter'] = None
+        return pickle_dict
+
+
+class LoopCompiler(object):
+    """Compile the bodies of frequently run FOR loops to closures."""
+
+    def __init__(self, threshold, interpreter, program, parser, memory, input_methods, basic_events):
+        """Initialise the compiler."""
+        # number of interpreted iterations before a loop is compiled
+        self._threshold = threshold
+        self._interpreter = interpreter
+        self._program = program
+        self._code = program.bytecode
+        self._parser = parser
+        self._memory = memory
+        self._input_methods = input_methods
+        self._basic_events = basic_events
+
+    def count(self, ins, forpos, nextpos):
+        """Count an interpreted iteration, return the loop if it should run compiled."""
+        loops = ins.get_cache('loops')
+        try:
+            loop = loops[forpos]
+        except KeyError:
+            loop = loops[forpos] = _Loop(forpos, nextpos)
+        loop.count += 1
+        if loop.count >= self._threshold:
+            return loop
+        return None
+
+    def get_stats(self):
+        """Return line number and statistics of loops that have been compiled."""
+        return sorted(
+            (self._program.get_line_number(loop.forpos), len(filter(None, loop.ops.values())),
+                loop.count, loop.compiled, loop.entries, loop.fallbacks)
+            for loop in self._code.get_cache('loops').itervalues()
+            if loop.entries
+        )
+
+    def run(self, loop, ins):
+        """Run a loop from its start until it ends or falls back; False if not applicable."""
+        interpreter = self._interpreter
+        if (ins is not self._code or not interpreter.run_mode or ins.tell() != loop.forpos
+                or not interpreter.for_stack or self._basic_events.enabled):
+            return False
+        record = interpreter.for_stack[-1]
+        if record[4:] != (loop.forpos, loop.nextpos):
+            return False
+        # DEFtype statements and CLEAR change what the names refer to
+        if loop.version != self._memory.slot_version:
+            loop.ops = {}
+            loop.version = self._memory.slot_version
+        loop.record = record
+        loop.counter = self._memory.scalars.view(record[0])
+        loop.entries += 1
+        ops = loop.ops
+        pos = loop.forpos
+        try:
+            while True:
+                if pos == loop.forpos:
+                    # poll for keystrokes and Break once per iteration
+                    self._input_methods.check_events(self._basic_events.check)
+                try:
+                    op = ops[pos]
+                except KeyError:
+                    op = ops[pos] = self._compile(loop, ins, pos)
+                if op is None:
+                    # not supported, leave to the interpreter
+                    ins.seek(pos)
+                    break
+                pos = op()
+                if pos is None:
+                    # loop has ended
+                    return True
+                if not loop.forpos <= pos < loop.nextpos:
+                    # jumped out of the loop body
+                    break
+        except error.BASICError:
+            loop.fallbacks += 1
+            raise
+        loop.fallbacks += 1
+        return True
+
+    def _compile(self, loop, ins, pos):
+        """Compile the statement starting at the given position; None if not supported."""
+        ins.seek(pos)
+        c = ins.skip_blank_read()
+        token = None
+        if c in tk.END_LINE:
+            # line number marker
+            token = ins.read(4)
+            if token[:2] == '\0\0' or len(token) < 4:
+                return None
+        elif c != ':':
+            ins.seek(-len(c), 1)
+        try:
+            keyword, callback, parse_args = self._parser.decode_statement(ins)
+            if keyword == tk.LET:
+                run = self._compile_let(ins)
+            elif keyword == tk.NEXT:
+                run = self._compile_next(loop, ins)
+            elif keyword in (None, tk.IF, tk.GOTO, tk.REM, tk.ELSE):
+                run = self._compile_statement(ins, keyword, callback, parse_args)
+            else:
+                run = None
+        except error.BASICError:
+            # leave syntax errors to the interpreter
+            run = None
+        if run is None:
+            return None
+        interpreter = self._interpreter
+        if token is None:
+            def op():
+                interpreter.current_statement = pos
+                return run()
+        else:
+            def op():
+                interpreter.current_statement = pos
+                interpreter.step_line(token)
+                return run()
+        return op
+
+    def _compile_let(self, ins):
+        """Compile an assignment."""
+        name = ins.read_name()
+        if not name:
+            return None
+        name = self._memory.complete_name(name)
+        if ins.skip_blank() in ('[', '('):
+            return self._compile_let_array(ins, name)
+        if not ins.skip_blank_read_if((tk.O_EQ,)):
+            return None
+        expr_pos = ins.tell()
+        sigil = name[-1]
+        scalars = self._memory.scalars
+        parse_expression = self._parser.parse_expression
+
+        def let_scalar():
+            ins.seek(expr_pos)
+            value = parse_expression(ins)
+            slot = scalars.slot(name)
+            if slot is None or isinstance(value, values.String):
+                scalars.set(name, value)
+            else:
+                slot[:] = values.to_type(sigil, value).to_bytes()
+            ins.require_end()
+            return ins.tell()
+        return let_scalar
+
+    def _compile_let_array(self, ins, name):
+        """Compile an assignment to an array element."""
+        indices_pos = ins.tell()
+        arrays = self._memory.arrays
+        parser = self._parser
+        parse_indices = parser.expression_parser.parse_indices
+
+        def let_array():
+            ins.seek(indices_pos)
+            parser.redo_on_break = True
+            indices = parse_indices(ins)
+            parser.redo_on_break = False
+            # pre-dim even if this is not a legal statement!
+            arrays.check_dim(name, indices)
+            ins.require_read((tk.O_EQ,))
+            value = parser.parse_expression(ins)
+            arrays.set(name, indices, value)
+            ins.require_end()
+            return ins.tell()
+        return let_array
+
+    def _compile_next(self, loop, ins):
+        """Compile the loop's own NEXT."""
+        if ins.skip_blank() not in tk.END_STATEMENT + (',',):
+            name = ins.read_name()
+            if not name or self._memory.complete_name(name) != loop.record[0]:
+                return None
+        if ins.tell() != loop.nextpos or ins.skip_blank() not in tk.END_STATEMENT:
+            return None
+        end = ins.tell()
+        forpos, nextpos = loop.forpos, loop.nextpos
+        interpreter = self._interpreter
+
+        def next_():
+            ins.seek(nextpos)
+            _, stop, step, sgn, _, _ = loop.record
+            counter = loop.counter
+            counter.iadd(step)
+            if counter.gt(stop) if sgn > 0 else stop.gt(counter):
+                interpreter.for_stack.pop()
+                ins.seek(end)
+                return None
+            loop.compiled += 1
+            ins.seek(forpos)
+            return forpos
+        return next_
+
+    def _compile_statement(self, ins, keyword, callback, parse_args):
+        """Compile a statement that is executed through its callback."""
+        start = ins.tell()
+        if not callback:
+            def statement():
+                ins.seek(start)
+                ins.require_end()
+                return ins.tell()
+        elif keyword == tk.IF:
+            # IF continues with the THEN or ELSE clause, or jumps
+            def statement():
+                ins.seek(start)
+                callback(parse_args(ins))
+                return ins.tell()
+        else:
+            def statement():
+                ins.seek(start)
+                callback(parse_args(ins))
+                ins.require_end()
+                return ins.tell()
+        return statement
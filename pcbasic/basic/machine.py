@@ -414,6 +414,13 @@ class Memory(object):
             block += self._get_video_memory_block(addr, min(length, video_len))
             addr += video_len
             length -= video_len
+        if self._memory.data_segment*0x10 <= addr and addr+length <= self.video_segment*0x10:
+            # data memory - read in contiguous ranges; preset values take precedence
+            block += self._memory.get_memory_block(addr, length)
+            for a, val in self._peek_values.iteritems():
+                if addr <= a < addr+length:
+                    block[len(block)-length + a-addr] = max(0, val)
+            return block
         for a in range(addr, addr+length):
             block += chr(max(0, self._get_memory(a)))
         return block
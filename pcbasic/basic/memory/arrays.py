@@ -10,7 +10,76 @@ import struct
 
 from ..base import error
 from .. import values
-from .scalars import get_name_in_memory
+from .scalars import get_name_bytes
+
+
+class _RecordIndex(object):
+    """Array records in order of allocation, located through a Fenwick tree of their sizes."""
+
+    def __init__(self):
+        """Create an empty index."""
+        # record names and sizes by slot; erased records have no name and size 0
+        self._names = []
+        self._sizes = []
+        # slot by record name
+        self._slots = {}
+        # Fenwick tree of sizes; node i holds the sum over slots i-(i&-i) to i-1
+        self._tree = [0]
+
+    def append(self, name, size):
+        """Add a record after all others."""
+        node = len(self._tree)
+        self._slots[name] = len(self._names)
+        self._names.append(name)
+        self._sizes.append(size)
+        total, i = size, node - 1
+        while i > node - (node & -node):
+            total += self._tree[i]
+            i -= i & -i
+        self._tree.append(total)
+
+    def remove(self, name):
+        """Remove a record; the records after it move down."""
+        slot = self._slots.pop(name)
+        size = self._sizes[slot]
+        self._names[slot], self._sizes[slot] = None, 0
+        i = slot + 1
+        while i < len(self._tree):
+            self._tree[i] -= size
+            i += i & -i
+        # drop erased slots once they are the majority
+        if len(self._names) > 2 * len(self._slots) + 8:
+            live = [(name, size) for name, size in zip(self._names, self._sizes) if name is not None]
+            self.__init__()
+            for name, size in live:
+                self.append(name, size)
+
+    def offset(self, name):
+        """Return the offset of a record; raise KeyError if it does not exist."""
+        total, i = 0, self._slots[name]
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, offset):
+        """Return the slot and start offset of the record containing an offset."""
+        slot, remaining = 0, offset
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            i = slot + step
+            if i < len(self._tree) and self._tree[i] <= remaining:
+                slot, remaining = i, remaining - self._tree[i]
+            step >>= 1
+        return slot, offset - remaining
+
+    def iter_from(self, offset):
+        """Iterate over names and offsets of the records from the one containing an offset."""
+        slot, start = self.find(offset)
+        for slot in xrange(slot, len(self._names)):
+            if self._names[slot] is not None:
+                yield self._names[slot], start
+                start += self._sizes[slot]
 
 
 class Arrays(object):
@@ -19,6 +88,7 @@ class Arrays(object):
         """Initialise arrays."""
         self._memory = memory
         self._values = values
+        self.current = 0
         self.clear()
         # OPTION BASE is unset
         self._base = None
@@ -40,7 +110,11 @@ class Arrays(object):
         self._dims = {}
         self._buffers = {}
         self._cache = {}
-        self._array_memory = {}
+        # bounds and strides of each dimension and element size, by array name
+        self._layout = {}
+        # array records in order of address
+        self._records = _RecordIndex()
+        self._memory.update_var_end(-self.current)
         self.current = 0
 
     def erase_(self, args):
@@ -53,18 +127,15 @@ class Arrays(object):
             dimensions = self._dims[name]
             record_len = 1 + max(3, len(name)) + 3 + 2*len(dimensions)
             freed_bytes = self.array_len(dimensions) * values.size_bytes(name) + record_len
-            erased_name_ptr, _ = self._array_memory[name]
             # delete buffers
             del self._dims[name]
             del self._buffers[name]
             del self._cache[name]
-            del self._array_memory[name]
-            # update memory model
-            for name in self._array_memory:
-                name_ptr, array_ptr = self._array_memory[name]
-                if name_ptr > erased_name_ptr:
-                    self._array_memory[name] = name_ptr - freed_bytes, array_ptr - freed_bytes
+            del self._layout[name]
+            # update memory model; the arrays after this one move down
+            self._records.remove(name)
             self.current -= freed_bytes
+            self._memory.update_var_end(-freed_bytes)
 
     def index(self, index, dimensions):
         """Return the flat index for a given dimensioned index."""
@@ -139,37 +210,60 @@ class Arrays(object):
             elif d < self._base:
                 raise error.BASICError(error.SUBSCRIPT_OUT_OF_RANGE)
         # update memory model
-        name_ptr = self.current
         record_len = self._record_size(name, dimensions)
         array_bytes = self._buffer_size(name, dimensions)
-        array_ptr = name_ptr + record_len
         total_bytes = record_len + array_bytes
         self._memory.check_free(total_bytes, error.OUT_OF_MEMORY)
         self.current += total_bytes
-        self._array_memory[name] = (name_ptr, array_ptr)
+        self._memory.update_var_end(total_bytes)
+        self._records.append(name, total_bytes)
         self._buffers[name] = bytearray(array_bytes)
         self._dims[name] = dimensions
         self._cache[name] = None
+        # the array base can't change while arrays are allocated
+        strides, area = [], 1
+        for d in dimensions:
+            strides.append(area)
+            area *= d + 1 - self._base
+        self._layout[name] = tuple(zip(dimensions, strides)), values.size_bytes(name)
+
+    def _auto_allocate(self, name, index):
+        """Allocate an array if indices are <= 10; return its bounds, strides and element size."""
+        # auto-dimension - 0..10 or 1..10
+        # this even fixes the dimensions if the index turns out to be out of range
+        self.allocate(name, [10] * len(index))
+        return self._layout[name]
+
+    def _flat_index(self, layout, index):
+        """Check indices against the bounds of an array and return the flat index."""
+        if len(index) != len(layout):
+            raise error.BASICError(error.SUBSCRIPT_OUT_OF_RANGE)
+        base = self._base
+        bigindex = 0
+        for i, (d, stride) in zip(index, layout):
+            # dimensions is the *maximum index number*, regardless of self._base
+            if not base <= i <= d:
+                raise error.BASICError(error.IFC if i < 0 else error.SUBSCRIPT_OUT_OF_RANGE)
+            bigindex += stride * (i - base)
+        return bigindex
+
+    def offsets(self, name, indices):
+        """Return the byte offsets of array elements in the array buffer; raise errors if out of range."""
+        if not indices:
+            return []
+        try:
+            layout, bytesize = self._layout[name]
+        except KeyError:
+            layout, bytesize = self._auto_allocate(name, indices[0])
+        return [bytesize * self._flat_index(layout, index) for index in indices]
 
     def check_dim(self, name, index):
         """Check if an array has been allocated. If not, auto-allocate if indices are <= 10; raise error otherwise."""
         try:
-            dimensions = self._dims[name]
+            layout, _ = self._layout[name]
         except KeyError:
-            # auto-dimension - 0..10 or 1..10
-            # this even fixes the dimensions if the index turns out to be out of range
-            dimensions = [10] * len(index)
-            self.allocate(name, dimensions)
-        lst = self._buffers[name]
-        if len(index) != len(dimensions):
-            raise error.BASICError(error.SUBSCRIPT_OUT_OF_RANGE)
-        for i, d in zip(index, dimensions):
-            if i < 0:
-                raise error.BASICError(error.IFC)
-            elif i < self._base or i > d:
-                # dimensions is the *maximum index number*, regardless of self._base
-                raise error.BASICError(error.SUBSCRIPT_OUT_OF_RANGE)
-        return dimensions, lst
+            layout, _ = self._auto_allocate(name, index)
+        self._flat_index(layout, index)
 
     def clear_base(self):
         """Unset the array base."""
@@ -186,10 +280,12 @@ class Arrays(object):
 
     def view_buffer(self, name, index):
         """Return a memoryview to an array element."""
-        dimensions, lst = self.check_dim(name, index)
-        bigindex = self.index(index, dimensions)
-        bytesize = values.size_bytes(name)
-        return memoryview(lst)[bigindex*bytesize:(bigindex+1)*bytesize]
+        try:
+            layout, bytesize = self._layout[name]
+        except KeyError:
+            layout, bytesize = self._auto_allocate(name, index)
+        offset = bytesize * self._flat_index(layout, index)
+        return memoryview(self._buffers[name])[offset:offset+bytesize]
 
     def get(self, name, index):
         """Retrieve a view of the value of an array element."""
@@ -208,63 +304,82 @@ class Arrays(object):
 
     def varptr(self, name, indices):
         """Retrieve the address of an array."""
-        dimensions = self._dims[name]
-        _, array_ptr = self._array_memory[name]
+        layout, bytesize = self._layout[name]
+        _, array_ptr = self._get_pointers(name, self._records.offset(name))
+        # indices are not checked against the bounds
+        bigindex = sum(stride * (i - self._base) for i, (_, stride) in zip(indices, layout))
         # arrays are kept at the end of the var list
-        return self._memory.var_current() + array_ptr + values.size_bytes(name) * self.index(indices, dimensions)
+        return self._memory.var_current() + array_ptr + bytesize * bigindex
+
+    def _get_pointers(self, name, name_ptr):
+        """Return the offsets of an array's record and buffer relative to the start of array space."""
+        return name_ptr, name_ptr + self._record_size(name, self._dims[name])
+
+    def _find_record(self, address):
+        """Find the array whose record contains a location relative to the start of array space."""
+        if not 0 <= address < self.current:
+            return None, None
+        for name, name_ptr in self._records.iter_from(address):
+            return self._get_pointers(name, name_ptr), name
+        return None, None
+
+    def _get_header(self, name):
+        """Memory representation of array record before the array buffer."""
+        dimensions = self._dims[name]
+        header = get_name_bytes(name)
+        header += struct.pack('<HB', self.array_size_bytes(name) + 1 + 2*len(dimensions), len(dimensions))
+        for d in dimensions:
+            header += struct.pack('<H', d + 1 - self._base)
+        return header
 
     def dereference(self, address):
         """Get a value for an array given its pointer address."""
-        found_addr = -1
-        found_name = None
-        for name, data in self._array_memory.iteritems():
-            addr = self._memory.var_current() + data[1]
-            if addr > found_addr and addr <= address:
-                found_addr = addr
-                found_name = name
-        if not found_name:
+        # arrays are kept at the end of the var list
+        address -= self._memory.var_current()
+        pointers, name = self._find_record(address)
+        if name is None:
+            return None
+        _, array_ptr = pointers
+        if address < array_ptr:
             return None
-        lst = self._buffers[name]
-        offset = address - found_addr
-        return self._values.from_bytes(lst[offset : offset+values.size_bytes(name)])
+        offset = address - array_ptr
+        return self._values.from_bytes(self._buffers[name][offset : offset+values.size_bytes(name)])
 
     def get_memory(self, address):
         """Retrieve data from data memory: array space """
-        name_addr = -1
-        arr_addr = -1
-        the_arr = None
-        for name in self._array_memory:
-            name_try, arr_try = self._array_memory[name]
-            if name_try <= address and name_try > name_addr:
-                name_addr, arr_addr = name_try, arr_try
-                the_arr = name
+        address -= self._memory.var_current()
+        pointers, the_arr = self._find_record(address)
         if the_arr is None:
             return -1
-        var_current = self._memory.var_current()
-        if address >= var_current + arr_addr:
-            offset = address - arr_addr - var_current
+        name_addr, arr_addr = pointers
+        if address >= arr_addr:
+            offset = address - arr_addr
             if offset >= self.array_size_bytes(the_arr):
                 return -1
             byte_array = self._buffers[the_arr]
             return byte_array[offset]
         else:
-            offset = address - name_addr - var_current
-            if offset < max(3, len(the_arr))+1:
-                return get_name_in_memory(the_arr, offset)
-            else:
-                offset -= max(3, len(the_arr))+1
-                dimensions = self._dims[the_arr]
-                data_rep = struct.pack('<HB', self.array_size_bytes(the_arr) + 1 + 2*len(dimensions), len(dimensions))
-                for d in dimensions:
-                    data_rep += struct.pack('<H', d + 1 - self._base)
-                return data_rep[offset]
+            return self._get_header(the_arr)[address - name_addr]
+
+    def get_memory_block(self, address, length):
+        """Retrieve a block of data from data memory: array space """
+        block = bytearray(length)
+        var_current = self._memory.var_current()
+        address -= var_current
+        end = address + length
+        for name, name_ptr in self._records.iter_from(max(0, address)):
+            if name_ptr >= end:
+                break
+            name_ptr, array_ptr = self._get_pointers(name, name_ptr)
+            for start, data in ((name_ptr, self._get_header(name)), (array_ptr, self._buffers[name])):
+                lo, hi = max(address, start), min(end, start + len(data))
+                if lo < hi:
+                    block[lo-address:hi-address] = data[lo-start:hi-start]
+        return block
 
     def get_strings(self):
-        """Return a list of views of string array elements."""
-        return [memoryview(buf)[i:i+3]
-                    for name, buf in self._buffers.iteritems()
-                        if name[-1] == values.STR
-                            for i in range(0, len(buf), 3)]
+        """Return a list of the buffers of string arrays."""
+        return [buf for name, buf in self._buffers.iteritems() if name[-1] == values.STR]
 
 
     ###########################################################################
@@ -298,6 +413,9 @@ class Arrays(object):
         if not remaining_dimensions:
             return []
         elif len(remaining_dimensions) == 1:
-            return [self.get(name, index+[i+(self._base or 0)]).to_value() for i in xrange(remaining_dimensions[0])]
+            offsets = self.offsets(name, [index+[i+(self._base or 0)] for i in xrange(remaining_dimensions[0])])
+            bytesize = values.size_bytes(name)
+            buf = memoryview(self._buffers[name])
+            return [self._values.create(buf[offset:offset+bytesize]).to_value() for offset in offsets]
         else:
             return [self._to_list(name, index+[i+(self._base or 0)], remaining_dimensions[1:]) for i in xrange(remaining_dimensions[0])]
@@ -53,8 +53,10 @@ class DataSegment(object):
     # protection flag
     protection_flag_addr = 1450
 
-    def __init__(self, total_memory, reserved_memory, max_reclen, max_files, double):
+    def __init__(self, total_memory, reserved_memory, max_reclen, max_files, double, float_engine, debug=False):
         """Initialise memory."""
+        # check the running counts against the memory model
+        self._debug = debug
         # BASIC stack (determined by CLEAR)
         # Initially, the stack space should be set to 512 bytes,
         # or one-eighth of the available memory, whichever is smaller.
@@ -72,8 +74,12 @@ class DataSegment(object):
         # data memory model: start of code section
         # code_start+1: offsets in files (4718 == 0x126e)
         self.code_start = self.field_mem_base + (max_files+1) * self.field_mem_offset
+        # end of code, variables and arrays, updated as they grow and shrink
+        self._var_end = self.code_start
         # default sigils for names
         self.deftype = ['!']*26
+        # incremented whenever a name may come to refer to a different variable
+        self.slot_version = 0
         # FIELD buffers
         self.max_files = max_files
         self.max_reclen = max_reclen
@@ -81,7 +87,7 @@ class DataSegment(object):
         # string space
         self.strings = values.StringSpace(self)
         # prepare string and number handler
-        self.values = values.Values(self.strings, double)
+        self.values = values.Values(self.strings, double, float_engine)
         # scalar space
         self.scalars = scalars.Scalars(self, self.values)
         # array space
@@ -113,6 +119,7 @@ class DataSegment(object):
     def clear_deftype(self):
         """Reset default sigils."""
         self.deftype = ['!']*26
+        self.slot_version += 1
 
     def deftype_(self, sigil, args):
         """DEFSTR/DEFINT/DEFSNG/DEFDBL: set type defaults for variables."""
@@ -123,6 +130,7 @@ class DataSegment(object):
             else:
                 stop = start
             self.deftype[start:stop+1] = [sigil] * (stop-start+1)
+        self.slot_version += 1
 
     def defint_(self, args):
         """Set default integer variables."""
@@ -146,6 +154,7 @@ class DataSegment(object):
             # deftype is not preserved on CHAIN with ALL, but is preserved with MERGE
             self.clear_deftype()
         # clear arrays, scalars and string space
+        self.slot_version += 1
         self.scalars.clear()
         self.arrays.clear()
         self.strings.clear()
@@ -206,9 +215,16 @@ class DataSegment(object):
             # copy the array buffers back
             self.arrays.view_full_buffer(name)[:] = buf
 
-    def _get_free(self):
+    def update_var_end(self, size):
+        """Account for code, variables or arrays taking or releasing a number of bytes."""
+        self._var_end += size
+
+    def get_free(self):
         """Return the amount of memory available to variables, arrays, strings and code."""
-        return self.strings.current - self.var_current() - self.arrays.current
+        if self._debug:
+            assert self._var_end == self.var_current() + self.arrays.current, (
+                'variable space ends at %d, not %d' % (self._var_end, self.var_current() + self.arrays.current))
+        return self.strings.current - self._var_end
 
     def _collect_garbage(self):
         """Collect garbage from string space. Compactify string storage."""
@@ -219,9 +235,9 @@ class DataSegment(object):
 
     def check_free(self, size, err):
         """Check if sufficient free memory is avilable, raise error if not."""
-        if self._get_free() <= size:
+        if self.get_free() <= size:
             self._collect_garbage()
-            if self._get_free() <= size:
+            if self.get_free() <= size:
                 raise error.BASICError(err)
 
     def var_start(self):
@@ -268,6 +284,34 @@ class DataSegment(object):
             # other BASIC data memory
             return max(0, self._get_basic_memory(addr))
 
+    def get_memory_block(self, addr, length):
+        """Retrieve a contiguous block of data memory."""
+        addr -= self.data_segment*0x10
+        end = addr + length
+        block = bytearray(
+            self.get_memory(self.data_segment*0x10 + a) for a in xrange(addr, min(end, self.code_start)))
+        # code memory
+        start, stop = max(addr, self.code_start), min(end, self.var_start())
+        if start < stop:
+            code = self.program.get_memory_block(start, stop - start)
+            block += code + bytearray(stop - start - len(code))
+        # variable memory, in the same sections as _get_var_memory
+        var_current = self.var_current()
+        sections = (
+            (var_current, self.scalars.get_memory_block),
+            (var_current + self.arrays.current, self.arrays.get_memory_block),
+            # unallocated var space
+            (self.strings.current + 1, None),
+            (end, self.strings.get_memory_block),
+        )
+        start = max(addr, self.var_start())
+        for boundary, get_block in sections:
+            stop = min(max(boundary, start), end)
+            if start < stop:
+                block += get_block(start, stop - start) if get_block else bytearray(stop - start)
+            start = stop
+        return block
+
     def set_memory(self, addr, val):
         """Set datat in data memory."""
         addr -= self.data_segment*0x10
@@ -375,6 +419,10 @@ class DataSegment(object):
             # array is allocated if retrieved and nonexistant
             return self.arrays.get(name, indices)
 
+    def resolve_scalar(self, name):
+        """Retrieve the buffer of an existing scalar variable, None if not allocated."""
+        return self.scalars.slot(self.complete_name(name))
+
     def let_(self, args):
         """LET: assign value to variable or array."""
         name, indices = next(args)
@@ -494,7 +542,7 @@ class DataSegment(object):
         if isinstance(val, values.String):
             # grabge collection if a string-valued argument is specified.
             self._collect_garbage()
-        return self.values.new_single().from_int(self._get_free())
+        return self.values.new_single().from_int(self.get_free())
 
     def lset_(self, args):
         """LSET: assign string value in-place; left justified."""
@@ -7,6 +7,7 @@ This file is released under the GNU GPL version 3 or later.
 """
 
 import struct
+from bisect import bisect_right
 
 from ..base import error
 from .. import values
@@ -19,6 +20,7 @@ class Scalars(object):
         """Initialise scalars."""
         self._memory = memory
         self._values = values
+        self.current = 0
         self.clear()
 
     def __contains__(self, varname):
@@ -37,6 +39,10 @@ class Scalars(object):
         """Clear scalar variables."""
         self._vars = {}
         self._var_memory = {}
+        # record addresses in ascending order and the corresponding names
+        self._record_ptrs = []
+        self._record_names = []
+        self._memory.update_var_end(-self.current)
         self.current = 0
 
     @staticmethod
@@ -73,7 +79,10 @@ class Scalars(object):
             # byte_size first_letter second_letter_or_nul remaining_length_or_nul
             var_ptr = name_ptr + self._record_size(name)
             self.current += size
+            self._memory.update_var_end(size)
             self._var_memory[name] = (name_ptr, var_ptr)
+            self._record_ptrs.append(name_ptr)
+            self._record_names.append(name)
         # don't change the value if just checking allocation
         if value is None:
             if name in self._vars:
@@ -100,6 +109,11 @@ class Scalars(object):
         """Retrieve a view of an existing scalar variable."""
         return self._values.create(self._vars[name])
 
+    def slot(self, name):
+        """Retrieve an existing scalar variable's buffer for direct access, or None."""
+        # the buffer stays in place until the variables are cleared
+        return self._vars.get(name)
+
     def view_buffer(self, name):
         """Retrieve a view of an existing scalar variable's buffer."""
         return memoryview(self._vars[name])
@@ -111,23 +125,20 @@ class Scalars(object):
 
     def dereference(self, address):
         """Get a value for a scalar given its pointer address."""
-        for name, data in self._var_memory.iteritems():
-            if data[1] == address:
+        index = bisect_right(self._record_ptrs, address) - 1
+        if index >= 0:
+            name = self._record_names[index]
+            if self._var_memory[name][1] == address:
                 return self.get(name)
         return None
 
     def get_memory(self, address):
         """Retrieve data from data memory: variable space """
-        name_addr = -1
-        var_addr = -1
-        the_var = None
-        for name in self._var_memory:
-            name_try, var_try = self._var_memory[name]
-            if name_try <= address and name_try > name_addr:
-                name_addr, var_addr = name_try, var_try
-                the_var = name
-        if the_var is None:
+        index = bisect_right(self._record_ptrs, address) - 1
+        if index < 0:
             return -1
+        the_var = self._record_names[index]
+        name_addr, var_addr = self._var_memory[the_var]
         if address >= var_addr:
             offset = address - var_addr
             if offset >= values.size_bytes(the_var):
@@ -138,9 +149,25 @@ class Scalars(object):
             offset = address - name_addr
             return get_name_in_memory(the_var, offset)
 
+    def get_memory_block(self, address, length):
+        """Retrieve a block of data from data memory: variable space """
+        block = bytearray(length)
+        end = address + length
+        first = max(0, bisect_right(self._record_ptrs, address) - 1)
+        for index in xrange(first, len(self._record_ptrs)):
+            if self._record_ptrs[index] >= end:
+                break
+            name = self._record_names[index]
+            name_ptr, var_ptr = self._var_memory[name]
+            for start, data in ((name_ptr, get_name_bytes(name)), (var_ptr, self._vars[name])):
+                lo, hi = max(address, start), min(end, start + len(data))
+                if lo < hi:
+                    block[lo-address:hi-address] = data[lo-start:hi-start]
+        return block
+
     def get_strings(self):
-        """Return a list of views of string scalars."""
-        return [memoryview(value) for name, value in self._vars.iteritems() if name[-1] == values.STR]
+        """Return a list of the buffers of string scalars."""
+        return [value for name, value in self._vars.iteritems() if name[-1] == values.STR]
 
 
 ###############################################################################
@@ -165,3 +192,7 @@ def get_name_in_memory(name, offset):
     else:
         # rest of name is encoded such that c1 == 'A'
         return ord(name[offset-1].upper()) - ord('A') + 0xC1
+
+def get_name_bytes(name):
+    """Memory representation of variable name record."""
+    return bytearray(get_name_in_memory(name, offset) for offset in range(max(3, len(name)) + 1))
@@ -21,19 +21,128 @@ from . import operators as op
 from . import userfunctions
 
 
-# AIMS
-# separate parsing from evaluation (ExpressionParser creates Expression, which can then evaluate)
-# difficulty: reproduce sequence of errors (syntax checks during evaluation)
-# approach: build an evaluation tree with operation and value nodes
-#   def OperationNode.evaluate(self):
-#       args = (arg.evaluate() for arg in self._args)
-#       return self._oper(*args)
-#
-# in the code below, this could be implemented by replacing evaluate steps
-# operation[token](*args) --> OperationNode(token, args)
-# adding the OperationNodes to the unit stack as we currently do values
-# when popped off the stack, they end up in the tree (through the argument list)
-# but are not yet evaluated.
+# Expressions are parsed and evaluated in one pass by the shunting-yard algorithm;
+# in the same pass, an evaluation tree is built that is cached by code position.
+# Evaluating the tree applies the same operations in the same order on the same stack;
+# parts whose syntax depends on run-time values, such as function arguments and
+# array indices, re-read the code stream so that errors are raised in the same sequence.
+
+
+class Expression(object):
+    """Evaluation tree for an expression at a given code position."""
+
+    def __init__(self, memory, root, end, guards):
+        """Set up the evaluation tree."""
+        self._memory = memory
+        self._root = root
+        # code position after the expression
+        self._end = end
+        # (name, number of arguments) for any FN calls; these determine the syntax
+        self.guards = guards
+
+    def evaluate(self, ins):
+        """Evaluate the expression and move the code stream to its end."""
+        with self._memory.get_stack() as units:
+            self._root.evaluate(ins, units)
+            ins.seek(self._end)
+            return units[0]
+
+
+class _ValueNode(object):
+    """Literal."""
+
+    def __init__(self, fn, *args):
+        """Set up the node."""
+        self._fn = fn
+        self._args = args
+
+    def evaluate(self, ins, units):
+        """Push the value on the stack."""
+        units.append(self._fn(*self._args))
+
+
+class _ScalarNode(object):
+    """Scalar variable, resolved to its buffer on first use."""
+
+    def __init__(self, memory, name):
+        """Set up the node."""
+        self._memory = memory
+        self._name = name
+        self._slot = None
+        self._version = None
+
+    def evaluate(self, ins, units):
+        """Push the variable's value on the stack."""
+        memory = self._memory
+        # DEFtype statements and CLEAR may change what the name refers to
+        if self._slot is None or self._version != memory.slot_version:
+            self._slot = memory.resolve_scalar(self._name)
+            self._version = memory.slot_version
+            if self._slot is None:
+                # not allocated; reading doesn't allocate, so we can't resolve yet
+                units.append(memory.get_variable(self._name, []))
+                return
+        units.append(memory.values.create(self._slot))
+
+
+class _ArrayNode(object):
+    """Array element."""
+
+    def __init__(self, parser, name, pos):
+        """Set up the node."""
+        self._parser = parser
+        self._name = name
+        # code position of the indices
+        self._pos = pos
+
+    def evaluate(self, ins, units):
+        """Parse the indices, push the element on the stack."""
+        ins.seek(self._pos)
+        indices = self._parser.parse_indices(ins)
+        units.append(self._parser._memory.get_variable(self._name, indices))
+
+
+class _FunctionNode(object):
+    """Function call."""
+
+    def __init__(self, parser, token, pos):
+        """Set up the node."""
+        self._parser = parser
+        self._token = token
+        # code position of the function token
+        self._pos = pos
+
+    def evaluate(self, ins, units):
+        """Parse the arguments, push the result on the stack."""
+        ins.seek(self._pos)
+        units.append(self._parser._parse_function(ins, self._token))
+
+
+class _OperationNode(object):
+    """Unary or binary operation."""
+
+    def __init__(self, values, oper, args):
+        """Set up the node."""
+        self._values = values
+        self._oper = oper
+        self._args = args
+
+    def evaluate(self, ins, units):
+        """Evaluate the operands, apply the operation and push the result on the stack."""
+        for arg in self._args:
+            arg.evaluate(ins, units)
+        args = [units.pop() for _ in self._args]
+        units.append(_apply(self._values, self._oper, args))
+
+
+def _apply(values, oper, args):
+    """Apply an operation to operands popped off the stack; recycle the consumed operands."""
+    result = oper(*reversed(args))
+    for arg in args:
+        # some operations pass an operand through unchanged
+        if arg is not result:
+            values.recycle(arg)
+    return result
 
 
 class ExpressionParser(object):
@@ -252,7 +361,22 @@ class ExpressionParser(object):
 
     def parse(self, ins):
         """Parse and evaluate tokenised (sub-)expression."""
+        cache = ins.get_cache('expressions')
+        pos = ins.tell()
+        expr = cache.get(pos)
+        if expr and (not expr.guards or all(
+                self.user_functions.number_arguments(name) == nargs for name, nargs in expr.guards)):
+            return expr.evaluate(ins)
+        value, root, guards = self._parse(ins)
+        cache[pos] = Expression(self._memory, root, ins.tell(), guards)
+        return value
+
+    def _parse(self, ins):
+        """Parse and evaluate tokenised (sub-)expression, build evaluation tree."""
         operations = deque()
+        # evaluation tree nodes, in step with the units stack
+        nodes = []
+        guards = []
         with self._memory.get_stack() as units:
             final = True
             # see https://en.wikipedia.org/wiki/Shunting-yard_algorithm
@@ -289,7 +413,7 @@ class ExpressionParser(object):
                         except KeyError:
                             # illegal combined ops like == raise syntax error here
                             raise error.BASICError(error.STX)
-                        self._drain(prec, operations, units)
+                        self._drain(prec, operations, units, nodes)
                     operations.append((oper, nargs, prec))
                 elif not (last in op.OPERATORS or last == ''):
                     # repeated unit ends expression
@@ -297,18 +421,27 @@ class ExpressionParser(object):
                     break
                 elif d == '(':
                     ins.read(len(d))
-                    # we need to create a new object or we'll overwrite our own stacks
-                    # this will not be needed if we localise stacks in the expression parser
-                    # either a separate class of just as local variables
-                    units.append(self.parse(ins))
+                    # the bracketed expression is evaluated on its own stack
+                    # its evaluation tree becomes part of ours
+                    value, node, inner_guards = self._parse(ins)
+                    units.append(value)
+                    nodes.append(node)
+                    guards.extend(inner_guards)
                     ins.require_read((')',))
                 elif d and d in string.ascii_letters:
                     name = ins.read_name()
                     error.throw_if(not name, error.STX)
+                    pos = ins.tell()
                     indices = self.parse_indices(ins)
                     units.append(self._memory.get_variable(name, indices))
+                    if indices:
+                        nodes.append(_ArrayNode(self, name, pos))
+                    else:
+                        nodes.append(_ScalarNode(self._memory, name))
                 elif d in self._functions:
-                    units.append(self._parse_function(ins, d))
+                    pos = ins.tell()
+                    units.append(self._parse_function(ins, d, guards))
+                    nodes.append(_FunctionNode(self, d, pos))
                     #if not isinstance(units[-1], values.String):
                     #    self._memory.strings.reset_temporaries()
                 elif d in tk.END_STATEMENT:
@@ -318,13 +451,17 @@ class ExpressionParser(object):
                     final = False
                     break
                 elif d == '"':
-                    units.append(self.read_string_literal(ins))
+                    fn, args = self._read_string_literal(ins)
+                    units.append(fn(*args))
+                    nodes.append(_ValueNode(fn, *args))
                 else:
-                    units.append(self.read_number_literal(ins))
+                    fn, args = self._read_number_literal(ins)
+                    units.append(fn(*args))
+                    nodes.append(_ValueNode(fn, *args))
             # raises IndexError for insufficient operators
             try:
-                self._drain(0, operations, units)
-                return units[0]
+                self._drain(0, operations, units, nodes)
+                return units[0], nodes[0], guards
             except IndexError:
                 # empty expression is a syntax error (inside brackets)
                 # or Missing Operand (in an assignment)
@@ -332,45 +469,63 @@ class ExpressionParser(object):
                     raise error.BASICError(error.MISSING_OPERAND)
                 raise error.BASICError(error.STX)
 
-    def _drain(self, precedence, operations, units):
+    def _drain(self, precedence, operations, units, nodes):
         """Drain evaluation stack until an operator of low precedence on top."""
         while operations:
             # this raises IndexError if there are not enough operators
             if precedence > operations[-1][2]:
                 break
             oper, narity, _ = operations.pop()
-            args = reversed([units.pop() for _ in range(narity)])
-            units.append(oper(*args))
+            args = [units.pop() for _ in range(narity)]
+            units.append(_apply(self._values, oper, args))
+            args = nodes[-narity:]
+            del nodes[-narity:]
+            nodes.append(_OperationNode(self._values, oper, args))
 
     def read_string_literal(self, ins):
         """Read a quoted string literal (no leading blanks), return as String."""
+        fn, args = self._read_string_literal(ins)
+        return fn(*args)
+
+    def _read_string_literal(self, ins):
+        """Read a quoted string literal, return constructor and arguments."""
         # address points to initial quote
         address = ins.tell_address()
         value = ins.read_string().strip('"')
         # if this is a program, create a string pointer to code space
         # and don't reserve space in string memory
         # +1 to point to start of payload, not intial quote
-        return self._values.from_str_at(value, None if address is None else address + 1)
+        return self._values.from_str_at, (value, None if address is None else address + 1)
 
     def read_number_literal(self, ins):
         """Return the value of a numeric literal (no leading blanks)."""
+        fn, args = self._read_number_literal(ins)
+        return fn(*args)
+
+    def _read_number_literal(self, ins):
+        """Read a numeric literal (no leading blanks), return constructor and arguments."""
         d = ins.peek()
         # number literals as ASCII are accepted in tokenised streams. only if they start with a figure (not & or .)
         # this happens e.g. after non-keywords like AS. They are not acceptable as line numbers.
         if d in string.digits:
-            return self._values.from_repr(ins.read_number(), allow_nonnum=False)
+            return self._values.from_repr, (ins.read_number(), False)
         # number literals
+        # these are decoded once and shared, so they must not be changed in-place
         elif d in tk.NUMBER:
-            return self._values.from_token(ins.read_number_token())
+            return self._values.literal, (ins.read_number_token(),)
         elif d == tk.T_UINT:
             # gw-basic allows adding line numbers to numbers
             # drop 0E token, interpret payload to unsigned integer
             value = struct.unpack('<bH', ins.read(3))[1]
-            # we need to convert to single to ensure it is interpreted as the unsigned value
-            return self._values.new_single().from_int(value)
+            return self._uint_to_single, (value,)
         else:
             raise error.BASICError(error.STX)
 
+    def _uint_to_single(self, value):
+        """Convert line number to Single."""
+        # we need to convert to single to ensure it is interpreted as the unsigned value
+        return self._values.new_single().from_int(value)
+
     def parse_indices(self, ins):
         """Parse array indices."""
         indices = []
@@ -387,7 +542,7 @@ class ExpressionParser(object):
     ###########################################################################
     # function and argument handling
 
-    def _parse_function(self, ins, token):
+    def _parse_function(self, ins, token, guards=None):
         """Parse a function starting with the given token."""
         ins.read(len(token))
         if token in self._simple:
@@ -408,6 +563,9 @@ class ExpressionParser(object):
             error.throw_if(not fnname, error.STX)
             # obtain function
             function = self.user_functions.get(fnname)
+            if guards is not None:
+                # the number of arguments determines where the expression continues
+                guards.append((fnname, function.number_arguments()))
             # get syntax
             parse_args = partial(self._gen_parse_arguments, length=function.number_arguments())
             fn = function.evaluate
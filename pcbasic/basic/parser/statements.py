@@ -54,6 +54,30 @@ class Parser(object):
 
     def parse_statement(self, ins):
         """Parse and execute a single statement."""
+        keyword, callback, parse_args = self.decode_statement(ins)
+        if not callback:
+            ins.require_end()
+            return
+        callback(parse_args(ins))
+        if keyword != tk.IF:
+            ins.require_end()
+
+    def decode_statement(self, ins):
+        """Read the statement keyword, return it with its callback and argument parser."""
+        # statements are decoded once per code position
+        cache = ins.get_cache('statements')
+        pos = ins.tell()
+        try:
+            keyword, callback, parse_args, end = cache[pos]
+        except KeyError:
+            keyword, callback, parse_args = self._decode_statement(ins)
+            cache[pos] = keyword, callback, parse_args, ins.tell()
+        else:
+            ins.seek(end)
+        return keyword, callback, parse_args
+
+    def _decode_statement(self, ins):
+        """Read the statement keyword, get its callback and argument parser."""
         # read keyword token or one byte
         ins.skip_blank()
         c = ins.read_keyword_token()
@@ -76,11 +100,9 @@ class Parser(object):
                 c = tk.LET
                 parse_args = self._simple[tk.LET]
             else:
-                ins.require_end()
-                return
-        self._callbacks[c](parse_args(ins))
-        if c != tk.IF:
-            ins.require_end()
+                # no statement
+                return None, None, None
+        return c, self._callbacks[c], parse_args
 
     def parse_name(self, ins):
         """Get scalar part of variable name from token stream."""
@@ -27,11 +27,30 @@ class UserFunction(object):
         self._varnames = varnames
         self._sigil = name[-1]
         self._expression_parser = expression_parser
+        # buffers of the parameter variables, resolved on first call
+        self._slots = None
+        self._version = None
 
     def number_arguments(self):
         """Retrieve number of arguments."""
         return len(self._varnames)
 
+    def _bind_parameters(self):
+        """Resolve the parameters to their variable buffers, allocating where needed."""
+        memory = self._memory
+        # DEFtype statements and CLEAR may change what the names refer to
+        if self._slots is None or self._version != memory.slot_version:
+            slots = []
+            for name in self._varnames:
+                # append sigil, if missing
+                name = memory.complete_name(name)
+                # allocate, but don't set, variables
+                memory.scalars.set(name)
+                slots.append(memory.scalars.slot(name))
+            self._slots = slots
+            self._version = memory.slot_version
+        return self._slots
+
     def evaluate(self, iargs):
         """Evaluate user-defined function."""
         # parse/evaluate arguments
@@ -40,34 +59,32 @@ class UserFunction(object):
         # recursion is not allowed as there's no way to terminate it
         if self._is_parsing:
             raise error.BASICError(error.OUT_OF_MEMORY)
-        # parse/evaluate function expression
-        # save existing vars
-        varsave = {}
-        for name in self._varnames:
-            if name in self._memory.scalars:
-                # copy the buffer
-                varsave[name] = self._memory.scalars.view(name).clone()
-        # set variables
-        for name, value in zip(self._varnames, args):
-            # append sigil, if missing
-            name = self._memory.complete_name(name)
-            self._memory.scalars.set(name, value)
+        slots = self._bind_parameters()
+        # the parameters occupy the variables' buffers for the duration of the call
+        # so that functions called from the function body see them, as in GW-BASIC
+        # arguments may be views on the parameters' own buffers, so take copies first
+        saved = [bytes(slot) for slot in slots]
+        data = [bytes(value.to_bytes()) for value in args]
+        if any(isinstance(value, values.String) for value in args):
+            self._memory.strings.fix_temporaries()
+        for slot, arg in izip(slots, data):
+            slot[:] = arg
         # set recursion flag
         self._is_parsing = True
         save_loc = self._codestream.tell()
         try:
             self._codestream.seek(self._start_loc)
+            # the evaluation tree for the function body is cached after the first call
             value = self._expression_parser.parse(self._codestream)
-            return values.to_type(self._sigil, value)
+            # the result may be a view on a parameter's buffer, which is about to be restored
+            return values.to_type(self._sigil, value).clone()
         finally:
             self._codestream.seek(save_loc)
             # unset recursion flag
             self._is_parsing = False
-            # restore existing vars
-            for name in varsave:
-                # re-assign the stored value
-                self._memory.scalars.view(name).copy_from(varsave[name])
-
+            # restore the variables
+            for slot, old in izip(slots, saved):
+                slot[:] = old
 
 
 class UserFunctionManager(object):
@@ -102,6 +119,13 @@ class UserFunctionManager(object):
             raise error.BASICError(error.STX)
         return fn
 
+    def number_arguments(self, fnname):
+        """Retrieve number of arguments of a function, None if not defined."""
+        fn = self._fn_dict.get(self._memory.complete_name(fnname))
+        if fn is None:
+            return None
+        return fn.number_arguments()
+
     def define(self, fnname, ins):
         """Define a function."""
         ins.skip_blank()
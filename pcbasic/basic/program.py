@@ -9,12 +9,30 @@ This file is released under the GNU GPL version 3 or later.
 import logging
 import struct
 import io
+from bisect import bisect_left, bisect_right
 
 from .base import error
 from .base import tokens as tk
 from . import values
 from . import converter
 
+
+class _LineStore(object):
+    """Program lines held as separate chunks, for fast bulk editing."""
+
+    def __init__(self, lines, chunks, tail):
+        """Initialise line store."""
+        # sorted line numbers
+        self.lines = lines
+        # line number and tokenised code for each line, without the leading \0 and offset
+        self.chunks = chunks
+        # program terminator and anything that was kept beyond it
+        self.tail = tail
+        # code size up to the terminator
+        self.size = sum(len(chunk) + 3 for chunk in chunks)
+        self.changed = False
+
+
 class Program(object):
     """BASIC program."""
 
@@ -24,6 +42,7 @@ class Program(object):
         self._memory = memory
         # program bytecode buffer
         self.bytecode = bytecode
+        self.code_size = 0
         self.erase()
         self.max_list_line = max_list_line
         self.allow_protect = allow_protect
@@ -38,21 +57,28 @@ class Program(object):
         """Size of code space """
         return self.code_size
 
+    def _set_code_size(self):
+        """Update the size of code space to the current position."""
+        code_size = self.bytecode.tell()
+        self._memory.update_var_end(code_size - self.code_size)
+        self.code_size = code_size
+
     def erase(self):
         """Erase the program from memory."""
         self.bytecode.seek(0)
         self.bytecode.write('\0\0\0')
         self.protected = False
         self.line_numbers = { 65536: 0 }
+        self._index_lines()
         self.last_stored = None
-        self.code_size = self.bytecode.tell()
+        self._set_code_size()
 
     def truncate(self, rest=''):
         """Write bytecode and cut the program of beyond the current position."""
         self.bytecode.write(rest if rest else '\0\0\0')
         self.bytecode.truncate()
         # cut off at current position
-        self.code_size = self.bytecode.tell()
+        self._set_code_size()
 
     def explicit_lines(self, *line_range):
         """Convert iterables of lines with '.' into explicit numbers."""
@@ -60,12 +86,24 @@ class Program(object):
 
     def get_line_number(self, pos):
         """Get line number for stream position."""
-        pre = -1
-        for linum in self.line_numbers:
-            linum_pos = self.line_numbers[linum]
-            if linum_pos <= pos and linum > pre:
-                pre = linum
-        return pre
+        # highest line number starting at or before the position
+        index = bisect_right(self._line_positions, pos)
+        if not index:
+            return -1
+        if self._lines_in_order:
+            return self._lines_by_position[index-1]
+        return max(self._lines_by_position[:index])
+
+    def _index_lines(self):
+        """Build sorted position-to-line index from line number dictionary."""
+        pairs = sorted((pos, linum) for linum, pos in self.line_numbers.iteritems())
+        self._line_positions = [pos for pos, _ in pairs]
+        self._lines_by_position = [linum for _, linum in pairs]
+        # lines are normally stored in order, but e.g. code pokes and RENUM can change this
+        self._lines_in_order = all(
+            linum < next_linum
+            for linum, next_linum in zip(self._lines_by_position, self._lines_by_position[1:])
+        )
 
     def rebuild_line_dict(self):
         """Preparse to build line number dictionary."""
@@ -85,6 +123,7 @@ class Program(object):
             scanpos = self.bytecode.tell()
             offsets.append(scanpos)
         self.line_numbers[65536] = scanpos
+        self._index_lines()
         # rebuild offsets
         self.bytecode.seek(0)
         last = 0
@@ -116,6 +155,16 @@ class Program(object):
             del self.line_numbers[key]
         for key in beyond:
             self.line_numbers[key] += length
+        # update position-to-line index
+        if self._lines_in_order:
+            # deleted lines are followed by the lines beyond, which have moved
+            after = bisect_left(self._lines_by_position, min(beyond))
+            start = after - len(deleteable)
+            self._line_positions[after:] = [_pos + length for _pos in self._line_positions[after:]]
+            del self._line_positions[start:after]
+            del self._lines_by_position[start:after]
+        else:
+            self._index_lines()
 
     def check_number_start(self, linebuf):
         """Check if the given line buffer starts with a line number."""
@@ -166,6 +215,83 @@ class Program(object):
         self.update_line_dict(pos, afterpos, length, deleteable, beyond)
         if not empty:
             self.line_numbers[scanline] = pos
+            if self._lines_in_order:
+                index = bisect_left(self._lines_by_position, scanline)
+                self._line_positions.insert(index, pos)
+                self._lines_by_position.insert(index, scanline)
+            else:
+                self._index_lines()
+        self.last_stored = scanline
+
+    def _split_lines(self):
+        """Split the bytecode into a line store; None if it is not in canonical form."""
+        if self.protected or not self._lines_in_order or self._line_positions[0] != 0:
+            return None
+        code = self.bytecode.getvalue()
+        positions, lines = self._line_positions, self._lines_by_position
+        end = positions[-1]
+        if code[end:end+3] != '\0\0\0':
+            return None
+        chunks = []
+        for pos, next_pos, linum in zip(positions, positions[1:], lines):
+            if (next_pos < pos + 5 or code[pos] != '\0' or
+                    struct.unpack_from('<HH', code, pos+1) != (self.code_start+1+next_pos, linum)):
+                return None
+            chunks.append(code[pos+3:next_pos])
+        return _LineStore(lines[:-1], chunks, code[end:])
+
+    def _join_lines(self, store):
+        """Write a line store back into the bytecode."""
+        code, positions, pos = [], [], 0
+        for chunk in store.chunks:
+            positions.append(pos)
+            pos += len(chunk) + 3
+            code.append(struct.pack('<BH', 0, self.code_start + 1 + pos) + chunk)
+        code.append(store.tail)
+        self.bytecode.seek(0)
+        self.truncate(''.join(code))
+        self.line_numbers = dict(zip(store.lines, positions))
+        self.line_numbers[65536] = pos
+        self._line_positions = positions + [pos]
+        self._lines_by_position = store.lines + [65536]
+        self._lines_in_order = True
+        # leave the pointer where store_line would have
+        self.bytecode.seek(pos + 3)
+
+    def _store_chunk(self, store, linebuf):
+        """Store the given line buffer in a line store."""
+        linebuf.seek(1)
+        scanline = self.lister.detokenise_line_number(linebuf)
+        empty = (linebuf.skip_blank_read() in tk.END_LINE)
+        if not store.lines or scanline > store.lines[-1]:
+            # listings are nearly always in ascending order; just append
+            index, exists = len(store.lines), False
+        else:
+            index = bisect_left(store.lines, scanline)
+            exists = index < len(store.lines) and store.lines[index] == scanline
+        if empty:
+            if not exists:
+                raise error.BASICError(error.UNDEFINED_LINE_NUMBER)
+            store.size -= len(store.chunks[index]) + 3
+            del store.lines[index]
+            del store.chunks[index]
+        else:
+            chunk = linebuf.getvalue()[3:]
+            # check for free memory up to the end of the new line, as store_line does
+            if index == len(store.lines):
+                pos = store.size
+            else:
+                pos = sum(len(before) + 3 for before in store.chunks[:index])
+            if self.code_start + 1 + pos + len(chunk) + 3 > self._memory.stack_start():
+                raise error.BASICError(error.OUT_OF_MEMORY)
+            store.size += len(chunk) + 3
+            if exists:
+                store.size -= len(store.chunks[index]) + 3
+                store.chunks[index] = chunk
+            else:
+                store.lines.insert(index, scanline)
+                store.chunks.insert(index, chunk)
+        store.changed = True
         self.last_stored = scanline
 
     def find_pos_line_dict(self, fromline, toline):
@@ -283,6 +409,7 @@ class Program(object):
             new_lines[old_to_new[old_line]] = self.line_numbers[old_line]
             del self.line_numbers[old_line]
         self.line_numbers.update(new_lines)
+        self._index_lines()
         return old_to_new
 
     def load(self, g, rebuild_dict=True):
@@ -300,28 +427,39 @@ class Program(object):
         elif g.filetype == 'A':
             # assume ASCII file
             # anything but numbers or whitespace: Direct Statement in File
+            # lines are collected in a line store and the bytecode is built once
             self.merge(g)
         else:
             logging.debug("Incorrect file type '%s' on LOAD", g.filetype)
         # rebuild line number dict and offsets
         if rebuild_dict and g.filetype != 'A':
             self.rebuild_line_dict()
-        self.code_size = self.bytecode.tell()
+        self._set_code_size()
 
     def merge(self, g):
         """Merge program from ascii or utf8 (if utf8_files is True) stream."""
-        while True:
-            line = g.read_line()
-            if line is None:
-                break
-            linebuf = self.tokeniser.tokenise_line(line)
-            if linebuf.read(1) == '\0':
-                # line starts with a number, add to program memory; store_line seeks to 1 first
-                self.store_line(linebuf)
-            else:
-                # we have read the :
-                if linebuf.skip_blank() not in tk.END_LINE:
-                    raise error.BASICError(error.DIRECT_STATEMENT_IN_FILE)
+        # edit lines in a separate store and write the bytecode once at the end
+        # fall back to storing line by line if the bytecode can't be split into lines
+        store = self._split_lines()
+        try:
+            while True:
+                line = g.read_line()
+                if line is None:
+                    break
+                linebuf = self.tokeniser.tokenise_line(line)
+                if linebuf.read(1) == '\0':
+                    # line starts with a number, add to program memory; store_line seeks to 1 first
+                    if store is not None:
+                        self._store_chunk(store, linebuf)
+                    else:
+                        self.store_line(linebuf)
+                else:
+                    # we have read the :
+                    if linebuf.skip_blank() not in tk.END_LINE:
+                        raise error.BASICError(error.DIRECT_STATEMENT_IN_FILE)
+        finally:
+            if store is not None and store.changed:
+                self._join_lines(store)
 
     def save(self, g):
         """Save the program to stream g in (A)scii, (B)ytecode or (P)rotected mode."""
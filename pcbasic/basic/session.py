@@ -37,6 +37,7 @@ from . import values
 from . import parser
 from . import devices
 from . import extensions
+from . import transpiler
 
 
 class Session(object):
@@ -52,7 +53,7 @@ class Session(object):
             video=u'vga', font=u'freedos',
             monitor=u'rgb', mono_tint=(0, 255, 0), screen_aspect=(4, 3),
             text_width=80, video_memory=262144, cga_low=False,
-            keys=u'', double=False,
+            keys=u'', double=False, float_engine=u'buffer', compile_loops=0,
             peek_values=None, device_params=None,
             current_device='Z', mount_dict=None,
             print_trigger='close', serial_buffer_size=128,
@@ -85,7 +86,8 @@ class Session(object):
         # set up variables and memory model state
         # initialise the data segment
         self.memory = memory.DataSegment(
-                    max_memory, reserved_memory, max_reclen, max_files, double)
+                    max_memory, reserved_memory, max_reclen, max_files, double, float_engine,
+                    debug=bool(debug))
         # values and variables
         self.strings = self.memory.strings
         self.values = self.memory.values
@@ -180,7 +182,8 @@ class Session(object):
         # initialise the interpreter
         self.interpreter = interpreter.Interpreter(
                 self.debugger, self.input_methods, self.screen, self.devices, self.sound,
-                self.values, self.memory, self.scalars, self.program, self.parser, self.basic_events)
+                self.values, self.memory, self.scalars, self.program, self.parser, self.basic_events,
+                compile_loops)
         # PLAY parser
         self.play_parser = sound.PlayParser(self.sound, self.memory, self.values)
         ######################################################################
@@ -249,6 +252,35 @@ class Session(object):
             with self.files.open_internal(prog, filetype=filetype, mode='O') as progfile:
                 self.program.save(progfile)
 
+    def compile_program(self, name):
+        """Write the program to a Python module, to be run with load_compiled."""
+        source = transpiler.Transpiler(self.parser, self.program).transpile()
+        if not name:
+            sys.stdout.write(source)
+            return
+        # only overwrite modules written by the transpiler
+        if os.path.exists(name) and not transpiler.is_compiled(name):
+            logging.error('Not overwriting %s: file is not a compiled program', name)
+            return
+        with open(name, 'wb') as module_file:
+            module_file.write(source)
+
+    def load_compiled(self, name):
+        """Run the program in memory through a module written by compile_program."""
+        if not transpiler.is_compiled(name):
+            logging.warning('Could not load compiled program %s: file is not a compiled program', name)
+            return False
+        try:
+            module = transpiler.load_module(name)
+        except (EnvironmentError, SyntaxError) as e:
+            logging.warning('Could not load compiled program %s: %s', name, e)
+            return False
+        runtime = transpiler.Runtime(self.interpreter, self.program, self.memory, self.values)
+        if not runtime.attach(module):
+            logging.warning('Compiled program %s does not match the program in memory', name)
+            return False
+        return True
+
     def execute(self, command):
         """Execute a BASIC statement."""
         for cmd in command.splitlines():
@@ -0,0 +1,571 @@
+"""
+PC-BASIC - transpiler.py
+Ahead-of-time translation of BASIC programs to Python modules
+
+(c) 2013--2018 Rob Hagemans
+This file is released under the GNU GPL version 3 or later.
+"""
+
+import imp
+import sys
+import string
+import struct
+from collections import deque
+
+from .base import error
+from .base import tokens as tk
+from .base import codestream
+from .parser import operators as op
+from . import values
+from ..version import __version__
+
+
+# A tokenised program is translated to a Python module with one function per program line.
+# Each function runs the statements of its line from a given statement onwards; the module's
+# build() function returns a table of these entry points by the code position at which the
+# interpreter would start each statement. While a program runs, the interpreter looks up its
+# position in this table and calls into compiled code, which works on the same variables,
+# value objects and expression stack and moves the code stream just as the interpreter does,
+# so that results, error line numbers and RESUME are unchanged. Jumps and statements that
+# are not translated return control to the interpreter. Since a module is only attached to
+# the exact program it was generated from, any change to the program disables it.
+
+# functions without side effects: values callback, number of arguments, last one optional
+_FUNCTIONS = {
+    tk.SGN: ('sgn_', 1, False),
+    tk.INT: ('int_', 1, False),
+    tk.FIX: ('fix_', 1, False),
+    tk.ABS: ('abs_', 1, False),
+    tk.SQR: ('sqr_', 1, False),
+    tk.SIN: ('sin_', 1, False),
+    tk.LOG: ('log_', 1, False),
+    tk.EXP: ('exp_', 1, False),
+    tk.COS: ('cos_', 1, False),
+    tk.TAN: ('tan_', 1, False),
+    tk.ATN: ('atn_', 1, False),
+    tk.CINT: ('cint_', 1, False),
+    tk.CSNG: ('csng_', 1, False),
+    tk.CDBL: ('cdbl_', 1, False),
+    tk.CVI: ('cvi_', 1, False),
+    tk.CVS: ('cvs_', 1, False),
+    tk.CVD: ('cvd_', 1, False),
+    tk.MKI: ('mki_', 1, False),
+    tk.MKS: ('mks_', 1, False),
+    tk.MKD: ('mkd_', 1, False),
+    tk.LEN: ('len_', 1, False),
+    tk.STR: ('str_', 1, False),
+    tk.VAL: ('val_', 1, False),
+    tk.ASC: ('asc_', 1, False),
+    tk.CHR: ('chr_', 1, False),
+    tk.SPACE: ('space_', 1, False),
+    tk.OCT: ('oct_', 1, False),
+    tk.HEX: ('hex_', 1, False),
+    tk.STRING: ('string_', 2, False),
+    tk.LEFT: ('left_', 2, False),
+    tk.RIGHT: ('right_', 2, False),
+    tk.MID: ('mid_', 3, True),
+}
+
+# names of operator functions in the values package
+_OPERATORS = dict(
+    (fn, name) for name, fn in vars(values).iteritems()
+    if fn in op.UNARY.values() or fn in op.BINARY.values()
+)
+
+# replacements for characters in BASIC names that are not allowed in Python names
+_PYTHON_CHARS = {'.': '_', '$': '_str', '%': '_int', '!': '_sng', '#': '_dbl'}
+
+# module name for loading compiled programs
+_MODULE_NAME = '_pcbasic_compiled'
+
+# first line of a compiled program module
+_SIGNATURE = '# BASIC program compiled by PC-BASIC\n'
+
+
+class _Unsupported(Exception):
+    """Code that is left to the interpreter."""
+
+
+def is_compiled(name):
+    """Check if a file is a module written by the transpiler."""
+    try:
+        with open(name, 'rb') as module_file:
+            return module_file.read(len(_SIGNATURE)) == _SIGNATURE
+    except EnvironmentError:
+        return False
+
+
+def load_module(name):
+    """Load a compiled program module from a Python source file."""
+    module = imp.load_source(_MODULE_NAME, name)
+    # don't keep the program around after it has been attached
+    del sys.modules[_MODULE_NAME]
+    return module
+
+
+class Transpiler(object):
+    """Translate a tokenised program to Python source."""
+
+    def __init__(self, parser, program):
+        """Initialise the transpiler."""
+        self._parser = parser
+        self._code = program.bytecode.getvalue()
+        # code positions of lines, including that of the program terminator
+        self._lines = sorted((pos, linum) for linum, pos in program.line_numbers.iteritems())
+
+    def transpile(self):
+        """Return the source code of a Python module for the program."""
+        # the code is analysed on a copy, as the statement parser moves the stream
+        self._ins = codestream.TokenisedStream()
+        self._ins.write(self._code)
+        self._names = {}
+        self._constants = {}
+        self._expressions = []
+        self._entries = []
+        lines = []
+        for (pos, linum), (end, _) in zip(self._lines, self._lines[1:]):
+            lines.extend(self._transpile_line(pos, linum, end))
+        source = [
+            _SIGNATURE.rstrip('\n'),
+            '"""',
+            'BASIC program compiled by PC-BASIC %s' % (__version__,),
+            'This file is generated; changes will be lost when it is recompiled.',
+            '"""',
+            '',
+            'PROGRAM = (',
+        ]
+        source.extend(
+            '    b%s' % (repr(self._code[pos:end]),)
+            for (pos, _), (end, _) in zip(self._lines, self._lines[1:] + [(None, None)])
+        )
+        source.extend([
+            ')',
+            '',
+            '',
+            'def build(rt):',
+            '    """Return the compiled statements by code position."""',
+            '    seek = rt.code.seek',
+            '    stack = rt.memory.get_stack',
+            '    reset = rt.memory.strings.reset_temporaries',
+            '    line, statement = rt.line, rt.statement',
+            '    jump, jump_sub, return_, if_ = rt.jump, rt.jump_sub, rt.return_, rt.if_',
+            '    ap1, ap2, args = rt.apply1, rt.apply2, rt.args',
+            '    V, A = rt.values, rt.address',
+        ])
+        source.extend(
+            '    %s = rt.%s(%r)' % (python_name, kind, name)
+            for python_name, (kind, name) in sorted(self._names.iteritems())
+        )
+        source.extend(
+            '    %s = V.literal(%r)' % (constant, token)
+            for token, constant in sorted(self._constants.iteritems(), key=lambda item: int(item[1][1:]))
+        )
+        source.extend(self._expressions)
+        source.extend(lines)
+        source.append('    return {')
+        source.extend('        %d: (%s, %d),' % entry for entry in self._entries)
+        source.append('    }')
+        source.append('')
+        return '\n'.join(source)
+
+    ###########################################################################
+    # statements
+
+    def _transpile_line(self, pos, linum, end):
+        """Translate the statements of a program line."""
+        ins = self._ins
+        # find the statement boundaries in the same way the interpreter skips statements
+        starts = [pos]
+        ins.seek(pos + 5)
+        while True:
+            ins.skip_to(tk.END_STATEMENT)
+            if ins.tell() >= end or ins.peek() != ':':
+                break
+            starts.append(ins.tell())
+            ins.read(1)
+        fn_name = 'line_%d' % (linum,)
+        lines = []
+        # blocks for statements left to the interpreter are only needed if we can get there
+        falls_through = False
+        for index, (start, after) in enumerate(zip(starts, starts[1:] + [end])):
+            try:
+                body = self._transpile_statement(start, after, end)
+            except (_Unsupported, error.BASICError):
+                if falls_through:
+                    # leave to the interpreter, which continues from here
+                    lines.extend([
+                        '        if i <= %d:' % (index,), '            seek(%d)' % (start,), '            return'
+                    ])
+                falls_through = False
+                continue
+            lines.append('        if i <= %d:' % (index,))
+            if index == 0:
+                lines.append('            line(%d, %d, %r)' % (start, start + 5, self._code[start+1:start+5]))
+            else:
+                lines.append('            statement(%d, %d)' % (start, start + 1))
+            lines.extend('            ' + line for line in body)
+            self._entries.append((start, fn_name, index))
+            falls_through = body[-1:] != ['return']
+        if not lines:
+            return []
+        if falls_through:
+            lines.append('        seek(%d)' % (end,))
+        return ['    def %s(i):' % (fn_name,)] + lines
+
+    def _transpile_statement(self, start, after, end):
+        """Translate a statement, return the lines of its body."""
+        ins = self._ins
+        # skip the line number marker or statement separator
+        ins.seek(start + 5 if self._code[start] == '\0' else start + 1)
+        keyword, callback, _ = self._parser.decode_statement(ins)
+        if not callback:
+            body = []
+        elif keyword == tk.LET:
+            body = self._transpile_let(ins)
+        elif keyword in (tk.GOTO, tk.GOSUB):
+            linum = self._read_jumpnum(ins)
+            if keyword == tk.GOTO:
+                body = ['jump(%d)' % (linum,), 'return']
+            else:
+                # the return position is just after the line number
+                body = ['seek(%d)' % (ins.tell(),), 'jump_sub(%d)' % (linum,), 'return']
+        elif keyword == tk.RETURN:
+            if ins.skip_blank() == tk.T_UINT:
+                raise _Unsupported()
+            body = ['return_()', 'return']
+        elif keyword == tk.IF:
+            body = ['reset()', 'cond = %s()' % (self._transpile_expression(ins),)]
+            ins.skip_blank_read_if((',',))
+            ins.require_read((tk.THEN, tk.GOTO))
+            # the interpreter continues with the THEN or ELSE clause, or jumps
+            return body + ['if_(cond, %d)' % (ins.tell(),), 'return']
+        elif keyword in (tk.REM, tk.ELSE):
+            return ['seek(%d)' % (end,), 'return']
+        else:
+            raise _Unsupported()
+        ins.require_end()
+        if ins.tell() != after:
+            raise _Unsupported()
+        return body
+
+    def _transpile_let(self, ins):
+        """Translate an assignment."""
+        name = ins.read_name()
+        if not name:
+            raise _Unsupported()
+        if ins.skip_blank() in ('[', '('):
+            array = self._get_name(name, 'array')
+            body = [
+                'indices = %s' % (self._transpile_indices(ins),),
+                # pre-dim even if this is not a legal statement!
+                '%s.check_dim(indices)' % (array,),
+            ]
+            ins.require_read((tk.O_EQ,))
+            return body + ['reset()', '%s.set(indices, %s())' % (array, self._transpile_expression(ins))]
+        ins.require_read((tk.O_EQ,))
+        return ['reset()', '%s.set(%s())' % (self._get_name(name, 'scalar'), self._transpile_expression(ins))]
+
+    def _read_jumpnum(self, ins):
+        """Read a line number pointer."""
+        ins.require_read((tk.T_UINT,))
+        token = ins.read(2)
+        if len(token) < 2:
+            raise _Unsupported()
+        return struct.unpack('<H', token)[0]
+
+    ###########################################################################
+    # expressions
+
+    def _transpile_expression(self, ins):
+        """Translate the expression at the current position to a function, return its name."""
+        # stack operations mirror those of the interpreter's shunting-yard parser
+        body = []
+        operations = deque()
+        units = 0
+        final = True
+        d = ''
+        while True:
+            last = d
+            ins.skip_blank()
+            d = ins.read_keyword_token()
+            ins.seek(-len(d), 1)
+            if d == tk.NOT and not (last in op.OPERATORS or last == ''):
+                break
+            elif d in op.OPERATORS:
+                ins.read(len(d))
+                prec = op.PRECEDENCE[d]
+                if d in op.COMBINABLE:
+                    nxt = ins.skip_blank()
+                    if nxt in op.COMBINABLE:
+                        d += ins.read(len(nxt))
+                if last in op.OPERATORS or last == '' or d == tk.NOT:
+                    nargs, oper = 1, op.UNARY.get(d)
+                else:
+                    nargs, oper = 2, op.BINARY.get(d)
+                    units = self._drain(prec, operations, units, body)
+                if not oper:
+                    raise _Unsupported()
+                operations.append((oper, nargs, prec))
+            elif not (last in op.OPERATORS or last == ''):
+                break
+            elif d == '(':
+                ins.read(len(d))
+                # bracketed expressions are evaluated on their own stack
+                body.append('u.append(%s())' % (self._transpile_expression(ins),))
+                ins.require_read((')',))
+                units += 1
+            elif d and d in string.ascii_letters:
+                name = ins.read_name()
+                if not name:
+                    raise _Unsupported()
+                if ins.skip_blank() in ('[', '('):
+                    indices = self._transpile_indices(ins)
+                    body.append('u.append(%s.get(%s))' % (self._get_name(name, 'array'), indices))
+                else:
+                    body.append('u.append(%s.get())' % (self._get_name(name, 'scalar'),))
+                units += 1
+            elif d in _FUNCTIONS:
+                body.append('u.append(%s)' % (self._transpile_function(ins, d),))
+                units += 1
+            elif d in tk.END_STATEMENT:
+                break
+            elif d in tk.END_EXPRESSION:
+                final = False
+                break
+            else:
+                body.append('u.append(%s)' % (self._transpile_literal(ins, d),))
+                units += 1
+        if self._drain(0, operations, units, body) != 1:
+            # empty expression; a syntax error or missing operand
+            raise _Unsupported()
+        fn_name = 'x%d' % (len(self._expressions),)
+        if len(body) == 1:
+            # a single value doesn't need the stack
+            body = ['    def %s():' % (fn_name,), '        return %s' % (body[0][len('u.append('):-1],)]
+        else:
+            body = (['    def %s():' % (fn_name,), '        with stack() as u:'] +
+                    ['            ' + line for line in body] + ['            return u[0]'])
+        self._expressions.append('\n'.join(body))
+        return fn_name
+
+    def _drain(self, precedence, operations, units, body):
+        """Apply operators down to the given precedence, return the number of units left."""
+        while operations:
+            if precedence > operations[-1][2]:
+                break
+            oper, nargs, _ = operations.pop()
+            if units < nargs:
+                raise _Unsupported()
+            # unary plus passes its operand through
+            if oper in _OPERATORS:
+                self._get_name(_OPERATORS[oper], 'function')
+                body.append('ap%d(u, %s)' % (nargs, _OPERATORS[oper]))
+            units -= nargs - 1
+        return units
+
+    def _transpile_indices(self, ins):
+        """Translate array indices to a list expression."""
+        indices = []
+        ins.require_read(('[', '('))
+        while True:
+            indices.append('to_int(%s())' % (self._transpile_expression(ins),))
+            if not ins.skip_blank_read_if((',',)):
+                break
+        ins.require_read((']', ')'))
+        self._get_name('to_int', 'function')
+        return '[%s]' % (', '.join(indices),)
+
+    def _transpile_function(self, ins, token):
+        """Translate a function call."""
+        ins.read(len(token))
+        name, length, optional = _FUNCTIONS[token]
+        ins.require_read(('(',))
+        arguments = [self._transpile_expression(ins)]
+        for _ in range(length - 1 - optional):
+            ins.require_read((',',))
+            arguments.append(self._transpile_expression(ins))
+        if optional:
+            if ins.skip_blank_read_if((',',)):
+                arguments.append(self._transpile_expression(ins))
+            else:
+                arguments.append('None')
+        ins.require_read((')',))
+        self._get_name(name, 'function')
+        return '%s(args(%s))' % (name, ', '.join(arguments))
+
+    def _transpile_literal(self, ins, d):
+        """Translate a string or number literal."""
+        if d == '"':
+            # strings point into the code, past the initial quote
+            address = ins.tell() + 1
+            value = ins.read_string().strip('"')
+            return 'V.from_str_at(%r, A + %d)' % (value, address)
+        elif d and d in string.digits:
+            return 'V.from_repr(%r, False)' % (ins.read_number(),)
+        elif d and d in tk.NUMBER:
+            # pre-decoded and shared, as in the interpreter
+            token = ins.read_number_token()
+            if token not in self._constants:
+                self._constants[token] = 'k%d' % (len(self._constants),)
+            return self._constants[token]
+        elif d == tk.T_UINT:
+            value = struct.unpack('<bH', ins.read(3))[1]
+            return 'V.new_single().from_int(%d)' % (value,)
+        raise _Unsupported()
+
+    def _get_name(self, name, kind):
+        """Get the Python name for a variable or values function."""
+        if kind == 'function':
+            python_name = name
+        else:
+            # BASIC names consist of letters, digits, periods and a sigil
+            python_name = '%s_%s' % (kind, ''.join(_PYTHON_CHARS.get(c, c) for c in name))
+        self._names[python_name] = (kind, name)
+        return python_name
+
+
+class Runtime(object):
+    """Connect a compiled program to the interpreter."""
+
+    def __init__(self, interpreter, program, memory, values):
+        """Initialise the runtime."""
+        self.interpreter = interpreter
+        self.code = program.bytecode
+        self.memory = memory
+        self.values = values
+        # memory address of code position 0, for string literals
+        self.address = program.code_start
+        self.jump = interpreter.jump
+        self.jump_sub = interpreter.jump_sub
+
+    def attach(self, module):
+        """Register the module's entry points with the interpreter; False if the program differs."""
+        if module.PROGRAM != self.code.getvalue():
+            return False
+        self.interpreter.attach_compiled(module.build(self))
+        return True
+
+    def function(self, name):
+        """Get a function from the values package."""
+        return getattr(values, name)
+
+    def scalar(self, name):
+        """Get a scalar variable."""
+        return _Scalar(self.memory, name)
+
+    def array(self, name):
+        """Get an array."""
+        return _Array(self.memory, name)
+
+    def line(self, pos, start, token):
+        """Enter a program line."""
+        self.interpreter.current_statement = pos
+        self.code.seek(start)
+        self.interpreter.step_line(token)
+
+    def statement(self, pos, start):
+        """Enter a statement."""
+        self.interpreter.current_statement = pos
+        self.code.seek(start)
+
+    def apply1(self, units, oper):
+        """Apply a unary operator on the stack."""
+        arg = units.pop()
+        result = oper(arg)
+        if arg is not result:
+            self.values.recycle(arg)
+        units.append(result)
+
+    def apply2(self, units, oper):
+        """Apply a binary operator on the stack."""
+        right = units.pop()
+        left = units.pop()
+        result = oper(left, right)
+        # some operations pass an operand through unchanged
+        if right is not result:
+            self.values.recycle(right)
+        if left is not result:
+            self.values.recycle(left)
+        units.append(result)
+
+    def args(self, *expressions):
+        """Evaluate function arguments as they are requested."""
+        for expr in expressions:
+            yield None if expr is None else expr()
+
+    def return_(self):
+        """RETURN to the position of the GOSUB."""
+        self.interpreter.return_(iter((None,)))
+
+    def if_(self, condition, thenpos):
+        """IF: branch from the position after THEN or GOTO."""
+        self.code.seek(thenpos)
+        self.interpreter.if_(self._if_args(condition))
+
+    def _if_args(self, condition):
+        """Generate the arguments for the interpreter's IF."""
+        yield condition
+        # we may have a line number immediately after THEN or ELSE
+        if self.code.skip_blank() == tk.T_UINT:
+            self.code.read(1)
+            yield struct.unpack('<H', self.code.read(2))[0]
+        else:
+            yield None
+
+
+class _Scalar(object):
+    """Scalar variable, resolved to its buffer on first use."""
+
+    def __init__(self, memory, name):
+        """Set up the variable."""
+        self._memory = memory
+        self._name = name
+        self._full_name = None
+        self._slot = None
+        self._version = None
+
+    def _resolve(self):
+        """Get the variable's buffer, None if not allocated."""
+        memory = self._memory
+        # DEFtype statements and CLEAR may change what the name refers to
+        if self._slot is None or self._version != memory.slot_version:
+            self._full_name = memory.complete_name(self._name)
+            self._slot = memory.scalars.slot(self._full_name)
+            self._version = memory.slot_version
+        return self._slot
+
+    def get(self):
+        """Retrieve the value."""
+        slot = self._resolve()
+        if slot is None:
+            return self._memory.scalars.get(self._full_name)
+        return self._memory.values.create(slot)
+
+    def set(self, value):
+        """Assign a value."""
+        slot = self._resolve()
+        if slot is None or isinstance(value, values.String):
+            self._memory.scalars.set(self._full_name, value)
+        else:
+            slot[:] = values.to_type(self._full_name[-1], value).to_bytes()
+
+
+class _Array(object):
+    """Array."""
+
+    def __init__(self, memory, name):
+        """Set up the array."""
+        self._memory = memory
+        self._name = name
+
+    def get(self, indices):
+        """Retrieve an element."""
+        return self._memory.get_variable(self._name, indices)
+
+    def check_dim(self, indices):
+        """Allocate the array if needed and check the indices."""
+        self._memory.arrays.check_dim(self._memory.complete_name(self._name), indices)
+
+    def set(self, indices, value):
+        """Assign to an element."""
+        self._memory.set_variable(self._name, indices, value)
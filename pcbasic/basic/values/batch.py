@@ -0,0 +1,290 @@
+"""
+PC-BASIC - batch.py
+Vectorised MBF arithmetic on arrays of values
+
+(c) 2013--2018 Rob Hagemans
+This file is released under the GNU GPL version 3 or later.
+"""
+
+# The operations here apply the algorithms of numbers.Float to whole arrays
+# of Single or Double values at once, with identical rounding.
+# Values are held as arrays of MBF words: each 4- or 8-byte value read as one little-endian unsigned int.
+# Singles are computed in uint64. Double mantissas and products need more than 64 bits,
+# so Doubles are computed on object arrays of Python ints, which is much slower.
+#
+# To operate on a BASIC array, e.g. from an extension:
+#     words = batch.from_buffer(memory.arrays.view_full_buffer(b'A!'), 4)
+#     result, errors = batch.mul(words, words)
+#     words[:] = result
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import numbers
+
+
+class _Format(object):
+    """Constants and integer helpers for a floating-point type."""
+
+    def __init__(self, cls):
+        """Take constants from the Single or Double class."""
+        self.bias = cls._bias
+        self.exp_shift = cls._exp_shift
+        self.den_mask = cls._den_mask
+        self.den_upper = cls._den_upper
+        self.carrymask = cls._carrymask
+        self.signmask = cls._signmask
+        self.mask = cls._mask
+        self.posmask = cls._posmask
+        self.pos_max = cls._word.unpack(cls.pos_max)[0]
+        self.neg_max = cls._word.unpack(cls.neg_max)[0]
+        # number of bits in the denormalised mantissa
+        self.man_bits = 8 * cls.size
+        self.word_dtype = '<u%d' % cls.size
+        # Single mantissas and their products fit in uint64, Double needs Python ints
+        self.dtype = numpy.uint64 if cls.size == 4 else object
+
+    def int(self, value):
+        """Convert an int or array to the working type."""
+        return numpy.asarray(value).astype(self.dtype)
+
+    def shr(self, man, shift):
+        """Shift right by an array of non-negative amounts."""
+        if self.dtype is not object:
+            # uint64 shifts by 64 bits or more are undefined; our mantissas are under 2**63
+            shift = numpy.minimum(shift, 63)
+        return man >> self.int(shift)
+
+    def low_bits(self, man, shift):
+        """Bits that would be lost by shifting right by an array of non-negative amounts."""
+        if self.dtype is not object:
+            shift = numpy.minimum(shift, 63)
+        return man & ((self.int(1) << self.int(shift)) - self.int(1))
+
+
+_formats = {}
+
+def _get_format(size):
+    """Get the constants for values of the given size."""
+    if numpy is None:
+        raise ImportError('NumPy is required for batch operations.')
+    try:
+        return _formats[size]
+    except KeyError:
+        cls = {4: numbers.IntSingle, 8: numbers.IntDouble}[size]
+        return _formats.setdefault(size, _Format(cls))
+
+
+###############################################################################
+# conversions
+
+def from_buffer(buf, size):
+    """Array of MBF words sharing memory with a buffer of Singles (size 4) or Doubles (size 8)."""
+    return numpy.asarray(memoryview(buf)).view(_get_format(size).word_dtype)
+
+def from_bytes(in_bytes, size):
+    """Array of MBF words copied from a byte string."""
+    return from_buffer(bytearray(in_bytes), size)
+
+def to_bytes(words):
+    """Byte string representation of an array of MBF words."""
+    return numpy.asarray(words).astype(words.dtype.newbyteorder('<')).tobytes()
+
+
+###############################################################################
+# implementation
+
+def _prepare(left, right):
+    """Check operands, return format and arrays."""
+    left, right = numpy.asarray(left), numpy.asarray(right)
+    if left.dtype.itemsize != right.dtype.itemsize:
+        raise TypeError('Operands must both be Single or both be Double.')
+    fmt = _get_format(left.dtype.itemsize)
+    return fmt, fmt.int(left), fmt.int(right)
+
+def _finish(fmt, words):
+    """Convert result to array of MBF words."""
+    return numpy.asarray(words).astype(fmt.word_dtype)
+
+def _is_zero(fmt, words):
+    """Zero exponent mask."""
+    return (words >> fmt.int(fmt.exp_shift)) == 0
+
+def _denormalise(fmt, words):
+    """Denormalise to exponent, shifted mantissa and sign arrays."""
+    exp = (words >> fmt.int(fmt.exp_shift)).astype(numpy.int64)
+    man = ((words << fmt.int(8)) & fmt.int(fmt.den_upper - 1)) | fmt.int(fmt.den_mask)
+    neg = (words & fmt.int(fmt.signmask)) != 0
+    return exp, man, neg
+
+def _normalise(fmt, exp, man, neg):
+    """Normalise from exponent, shifted mantissa and sign; return words and overflow mask."""
+    # zero denormalised mantissa -> make zero
+    zero = (man == 0) | (exp <= 0)
+    man = numpy.where(zero, fmt.int(fmt.den_mask), man)
+    # shift left if subnormal
+    while True:
+        sub = man < fmt.int(fmt.den_mask - 1)
+        if not sub.any():
+            break
+        exp = numpy.where(sub, exp - 1, exp)
+        man = numpy.where(sub, man << fmt.int(1), man)
+    # round to nearest; halves to even (Gaussian rounding)
+    low = man & fmt.int(0xff)
+    round_up = (low > fmt.int(0x80)) | ((low == fmt.int(0x80)) & ((man & fmt.int(0x100)) != 0))
+    man = (man & fmt.int(fmt.carrymask)) + numpy.where(round_up, fmt.int(0x100), fmt.int(0))
+    carry = man >= fmt.int(fmt.den_upper)
+    exp = numpy.where(carry, exp + 1, exp)
+    man = numpy.where(carry, man >> fmt.int(1), man)
+    words = (man >> fmt.int(8)) & numpy.where(neg, fmt.int(fmt.mask), fmt.int(fmt.posmask))
+    # on underflow, set to zero, but leave mantissa as is
+    exp_bits = fmt.int(numpy.maximum(exp, 0)) << fmt.int(fmt.exp_shift)
+    words = numpy.where(exp > 0, words | exp_bits, words)
+    overflow = (exp > 255) & ~zero
+    words = numpy.where(overflow, numpy.where(neg, fmt.int(fmt.neg_max), fmt.int(fmt.pos_max)), words)
+    words = numpy.where(zero, fmt.int(0), words)
+    return words, overflow
+
+def _add_den(fmt, lden, rden):
+    """Denormalised add."""
+    lexp, lman, lneg = lden
+    rexp, rman, rneg = rden
+    left_zero, right_zero = (lexp == 0), (rexp == 0)
+    # ensure right is larger
+    swap = (lexp > rexp) | ((lexp == rexp) & (lman > rman))
+    sexp, sman, sneg = numpy.where(swap, rexp, lexp), numpy.where(swap, rman, lman), numpy.where(swap, rneg, lneg)
+    bexp, bman, bneg = numpy.where(swap, lexp, rexp), numpy.where(swap, lman, rman), numpy.where(swap, lneg, rneg)
+    shift = bexp - sexp
+    # zero flag for quirky rounding
+    # only set if all the bits we lose by matching exponents were zero
+    zero_flag = fmt.low_bits(sman, shift) == 0
+    sub_flag = sneg != bneg
+    # match exponents
+    sman = fmt.shr(sman, shift)
+    # shortcut (this affects quirky rounding)
+    shortcut = ((sman < fmt.int(0x80)) | ((sman == fmt.int(0x80)) & zero_flag)) & sub_flag
+    # add mantissas, taking sign into account
+    # where we subtract, the smaller operand is subtracted from the bigger one
+    man = numpy.where(sub_flag, bman - numpy.where(sub_flag, sman, fmt.int(0)), sman + bman)
+    neg = numpy.where(sub_flag, bneg, sneg)
+    carry = ~sub_flag & (man >= fmt.int(fmt.den_upper))
+    exp = numpy.where(carry, bexp + 1, bexp)
+    man = numpy.where(carry, man >> fmt.int(1), man)
+    # break tie for rounding if we're at exact half after dropping digits
+    man = numpy.where(~zero_flag & ~sub_flag, man | fmt.int(1), man)
+    # attempt to match GW-BASIC subtraction rounding
+    quirk = sub_flag & ((man & fmt.int(0x1c0)) == fmt.int(0x80)) & ((man & fmt.int(0x1df)) != fmt.int(0x80))
+    man = numpy.where(quirk, man & fmt.int(fmt.carrymask + 0x7f), man)
+    # apply shortcuts and zero operands; a zero right hand side takes precedence
+    for cond, (cexp, cman, cneg) in (
+            (shortcut, (bexp, bman, bneg)), (left_zero, rden), (right_zero, lden)):
+        exp = numpy.where(cond, cexp, exp)
+        man = numpy.where(cond, cman, man)
+        neg = numpy.where(cond, cneg, neg)
+    return exp, man, neg
+
+def _bring_to_range(fmt, exp, man, lower, upper):
+    """Bring mantissas to range (lower, upper]."""
+    while True:
+        low = man <= fmt.int(lower)
+        if not low.any():
+            break
+        exp = numpy.where(low, exp - 1, exp)
+        man = numpy.where(low, man << fmt.int(1), man)
+    while True:
+        high = man > fmt.int(upper)
+        if not high.any():
+            break
+        exp = numpy.where(high, exp + 1, exp)
+        man = numpy.where(high, man >> fmt.int(1), man)
+    return exp, man
+
+
+###############################################################################
+# operations on arrays of MBF words
+# arithmetic operations return the result and a mask of values that raised an error
+# for those, the result is the value the scalar operation leaves on error
+
+def add(left, right):
+    """Add arrays of MBF words."""
+    fmt, left, right = _prepare(left, right)
+    words, overflow = _normalise(fmt, *_add_den(fmt, _denormalise(fmt, left), _denormalise(fmt, right)))
+    return _finish(fmt, words), overflow
+
+def sub(left, right):
+    """Subtract arrays of MBF words."""
+    fmt, left, right = _prepare(left, right)
+    rexp, rman, rneg = _denormalise(fmt, right)
+    words, overflow = _normalise(fmt, *_add_den(fmt, _denormalise(fmt, left), (rexp, rman, ~rneg)))
+    return _finish(fmt, words), overflow
+
+def mul(left, right):
+    """Multiply arrays of MBF words."""
+    fmt, left, right = _prepare(left, right)
+    zero = _is_zero(fmt, left) | _is_zero(fmt, right)
+    lexp, lman, lneg = _denormalise(fmt, left)
+    rexp, rman, rneg = _denormalise(fmt, right)
+    exp = lexp + rexp - fmt.bias - 8
+    neg = lneg != rneg
+    man = lman * rman
+    zero |= exp < -31
+    # keep zeroes out of the range loops
+    man = numpy.where(zero, fmt.int(fmt.den_mask), man)
+    # drop some precision
+    exp, man = _bring_to_range(fmt, exp, man, fmt.den_mask >> 4, fmt.den_upper >> 4)
+    # rounding quirk
+    quirk = (man & fmt.int(0xf)) == fmt.int(0x9)
+    man = numpy.where(quirk, man & fmt.int(fmt.carrymask + 0xfe), man)
+    words, overflow = _normalise(fmt, exp, man, neg)
+    # set any zeroes to standard zero
+    words = numpy.where(zero, fmt.int(0), words)
+    return _finish(fmt, words), overflow & ~zero
+
+def div(left, right):
+    """Divide arrays of MBF words."""
+    fmt, left, right = _prepare(left, right)
+    div_zero = _is_zero(fmt, right)
+    left_zero = _is_zero(fmt, left)
+    lexp, lman, lneg = _denormalise(fmt, left)
+    rexp, rman, rneg = _denormalise(fmt, right)
+    neg = lneg != rneg
+    exp = lexp - (rexp - fmt.bias - 8) + 1
+    # long division of mantissas
+    # the divisor has its top bit set, so this takes the same number of steps for all values
+    work, man = lman, fmt.int(numpy.zeros(lman.shape, dtype=numpy.int64))
+    for _ in range(fmt.man_bits):
+        man = man << fmt.int(1)
+        exp = exp - 1
+        step = work > rman
+        work = numpy.where(step, work - numpy.where(step, rman, fmt.int(0)), work)
+        man = numpy.where(step, man + fmt.int(1), man)
+        rman = rman >> fmt.int(1)
+    words, overflow = _normalise(fmt, exp, man, neg)
+    # zero divided by anything nonzero is left unchanged
+    words = numpy.where(left_zero, left, words)
+    # division by zero gives max float with the sign of the left hand side
+    max_words = numpy.where(
+        (left & fmt.int(fmt.signmask)) != 0, fmt.int(fmt.neg_max), fmt.int(fmt.pos_max))
+    words = numpy.where(div_zero, max_words, words)
+    return _finish(fmt, words), (overflow & ~left_zero) | div_zero
+
+def gt(left, right):
+    """Greater than, for arrays of MBF words."""
+    fmt, left, right = _prepare(left, right)
+    lzero, rzero = _is_zero(fmt, left), _is_zero(fmt, right)
+    lneg = (left & fmt.int(fmt.signmask)) != 0
+    rneg = (right & fmt.int(fmt.signmask)) != 0
+    # with equal signs, we can compare floats as if they were ints
+    result = numpy.where(lneg, ~rzero & (right > left), left > right)
+    result = numpy.where(lneg != rneg, ~lneg, result)
+    # zero is only greater than negative
+    return numpy.where(lzero, rneg & ~rzero, result).astype(bool)
+
+def eq(left, right):
+    """Equals, for arrays of MBF words."""
+    fmt, left, right = _prepare(left, right)
+    lzero, rzero = _is_zero(fmt, left), _is_zero(fmt, right)
+    # all zeroes are equal
+    return numpy.where(lzero, rzero, left == right).astype(bool)
@@ -35,6 +35,10 @@ BLANKS = b' \t\n'
 # ASCII separators - these cause string representations to evaluate to zero
 SEPARATORS = b'\x1c\x1d\x1f'
 
+# integer buffer formats
+_SIGNED = struct.Struct('<h')
+_UNSIGNED = struct.Struct('<H')
+
 
 
 ##############################################################################
@@ -43,12 +47,17 @@ SEPARATORS = b'\x1c\x1d\x1f'
 class Value(object):
     """Abstract base class for value types."""
 
+    # values are created for every intermediate result, so avoid an instance dict
+    # _owned: the buffer was allocated for this value and is not a view on variable memory
+    __slots__ = ('_buffer', '_values', '_owned')
+
     sigil = None
     size = None
 
     def __init__(self, buffer, values):
         """Initialise the value."""
-        if buffer is None:
+        self._owned = buffer is None
+        if self._owned:
             buffer = bytearray(self.size)
         self._buffer = memoryview(buffer)
         self._values = values
@@ -64,13 +73,21 @@ class Value(object):
 
 
     def __getstate__(self):
+        """Pickle."""
+        pickle_dict = dict(
+            (name, getattr(self, name))
+            for cls in type(self).__mro__ for name in getattr(cls, '__slots__', ())
+            if hasattr(self, name)
+        )
         # can't pickle memoryview
-        self._buffer = bytearray(self._buffer)
-        return self.__dict__
+        pickle_dict['_buffer'] = bytearray(self._buffer)
+        return pickle_dict
 
     def __setstate__(self, pickle_dict):
+        """Unpickle."""
+        for name, value in pickle_dict.iteritems():
+            setattr(self, name, value)
         # can't pickle memoryview
-        self.__dict__ = pickle_dict
         self._buffer = memoryview(self._buffer)
 
     def to_value(self):
@@ -78,11 +95,11 @@ class Value(object):
 
     def clone(self):
         """Create a copy."""
-        return self.__class__(None, self._values).from_bytes(self._buffer)
+        return self._values.allocate(self.__class__).from_bytes(self._buffer)
 
     def new(self):
         """Create a new null value."""
-        return self.__class__(None, self._values)
+        return self._values.allocate(self.__class__)
 
     def copy_from(self, other):
         """Copy another value into this one."""
@@ -109,6 +126,8 @@ class Value(object):
 class Number(Value):
     """Abstract base class for numeric value."""
 
+    __slots__ = ('error_handler',)
+
     zero = None
     pos_max = None
     neg_max = None
@@ -141,6 +160,8 @@ class Number(Value):
 class Integer(Number):
     """16-bit signed little-endian integer."""
 
+    __slots__ = ()
+
     sigil = b'%'
     size = 2
 
@@ -153,18 +174,19 @@ class Integer(Number):
 
     def is_negative(self):
         """Value is negative."""
-        return (ord(self._buffer[-1]) & 0x80) != 0
+        return _SIGNED.unpack_from(self._buffer)[0] < 0
 
     def sign(self):
         """Sign of value."""
-        return -1 if (ord(self._buffer[-1]) & 0x80) != 0 else (0 if self._buffer == b'\0\0' else 1)
+        value = _SIGNED.unpack_from(self._buffer)[0]
+        return -1 if value < 0 else (0 if not value else 1)
 
     def to_int(self, unsigned=False):
         """Return value as Python int."""
         if unsigned:
-            return struct.unpack('<H', self._buffer)[0]
+            return _UNSIGNED.unpack_from(self._buffer)[0]
         else:
-            return struct.unpack('<h', self._buffer)[0]
+            return _SIGNED.unpack_from(self._buffer)[0]
 
     def from_int(self, in_int, unsigned=False):
         """Set value to Python int."""
@@ -172,14 +194,13 @@ class Integer(Number):
             # we can in fact assign negatives as 'unsigned'
             if in_int < 0:
                 in_int += 0x10000
-            intformat = '<H'
-            maxint = 0xffff
+            if not (0 <= in_int <= 0xffff):
+                raise error.BASICError(error.OVERFLOW)
+            _UNSIGNED.pack_into(self._buffer, 0, in_int)
         else:
-            intformat = '<h'
-            maxint = 0x7fff
-        if not (-0x8000 <= in_int <= maxint):
-            raise error.BASICError(error.OVERFLOW)
-        struct.pack_into(intformat, self._buffer, 0, in_int)
+            if not (-0x8000 <= in_int <= 0x7fff):
+                raise error.BASICError(error.OVERFLOW)
+            _SIGNED.pack_into(self._buffer, 0, in_int)
         return self
 
     def to_integer(self, unsigned=False):
@@ -188,15 +209,15 @@ class Integer(Number):
 
     def to_double(self):
         """Convert to double."""
-        return Double(None, self._values).from_integer(self)
+        return self._values.new_double().from_integer(self)
 
     def to_single(self):
         """Convert to single."""
-        return Single(None, self._values).from_integer(self)
+        return self._values.new_single().from_integer(self)
 
     def to_float(self, allow_double=True):
         """Convert to float."""
-        return Single(None, self._values).from_integer(self)
+        return self._values.new_single().from_integer(self)
 
     to_value = to_int
     from_value = from_int
@@ -288,44 +309,40 @@ class Integer(Number):
         """Truncate towards negative infinity in-place (no-op)."""
         return self
 
+    # arithmetic is done on Python ints, unpacked from and packed into the buffers directly
+
     def ineg(self):
         """Negate in-place."""
-        if self._buffer == '\x00\x80':
+        value = _SIGNED.unpack_from(self._buffer)[0]
+        if value == -0x8000:
             raise error.BASICError(error.OVERFLOW)
-        lsb = (ord(self._buffer[0]) ^ 0xff) + 1
-        msb = ord(self._buffer[1]) ^ 0xff
-        # apply carry
-        if lsb > 0xff:
-            lsb -= 0x100
-            msb += 1
-        # ignore overflow, since -0 == 0
-        self._buffer[:] = chr(lsb) + chr(msb & 0xff)
+        _SIGNED.pack_into(self._buffer, 0, -value)
         return self
 
     def iabs(self):
         """Absolute value in-place."""
-        if (ord(self._buffer[-1]) & 0x80):
+        if _SIGNED.unpack_from(self._buffer)[0] < 0:
             return self.ineg()
 
     def iadd(self, rhs):
         """Add another Integer in-place."""
-        lsb = ord(self._buffer[0]) + ord(rhs._buffer[0])
-        msb = ord(self._buffer[1]) + ord(rhs._buffer[1])
-        # apply carry
-        if lsb > 0xff:
-            lsb -= 0x100
-            msb += 1
-        # overflow if signs were equal and have changed
-        if (ord(self._buffer[1]) > 0x7f) == (ord(rhs._buffer[1]) > 0x7f) != (msb > 0x7f):
+        value = _SIGNED.unpack_from(self._buffer)[0] + _SIGNED.unpack_from(rhs._buffer)[0]
+        if not (-0x8000 <= value <= 0x7fff):
             raise error.BASICError(error.OVERFLOW)
-        self._buffer[:] = chr(lsb) + chr(msb & 0xff)
+        _SIGNED.pack_into(self._buffer, 0, value)
         return self
 
     def isub(self, rhs):
         """Subtract another Integer in-place."""
-        # we can't apply the neg on the lhs and avoid a copy
-        # because of things like -32768 - (-1)
-        return self.iadd(rhs.clone().ineg())
+        rvalue = _SIGNED.unpack_from(rhs._buffer)[0]
+        # the right hand side is negated first, so x - (-32768) overflows for any x
+        if rvalue == -0x8000:
+            raise error.BASICError(error.OVERFLOW)
+        value = _SIGNED.unpack_from(self._buffer)[0] - rvalue
+        if not (-0x8000 <= value <= 0x7fff):
+            raise error.BASICError(error.OVERFLOW)
+        _SIGNED.pack_into(self._buffer, 0, value)
+        return self
 
     # no imul - we always promote to float first for multiplication
     # no idiv - we always promote to float first for true division
@@ -335,9 +352,9 @@ class Integer(Number):
         if rhs.is_zero():
             # division by zero - return single-precision maximum
             if self.is_negative():
-                max_val = Single(None, self._values).from_bytes(Single.neg_max)
+                max_val = self._values.new_single().from_bytes(Single.neg_max)
             else:
-                max_val = Single(None, self._values).from_bytes(Single.pos_max)
+                max_val = self._values.new_single().from_bytes(Single.pos_max)
             raise ZeroDivisionError(max_val)
         dividend = self.to_int()
         divisor = rhs.to_int()
@@ -352,9 +369,9 @@ class Integer(Number):
         if rhs.is_zero():
             # division by zero - return single-precision maximum
             if self.is_negative():
-                max_val = Single(None, self._values).from_bytes(Single.neg_max)
+                max_val = self._values.new_single().from_bytes(Single.neg_max)
             else:
-                max_val = Single(None, self._values).from_bytes(Single.pos_max)
+                max_val = self._values.new_single().from_bytes(Single.pos_max)
             raise ZeroDivisionError(max_val)
         dividend = self.to_int()
         divisor = rhs.to_int()
@@ -371,17 +388,7 @@ class Integer(Number):
         if isinstance(rhs, Float):
             # upgrade to Float
             return rhs.new().from_integer(self).gt(rhs)
-        isneg = ord(self._buffer[-1]) & 0x80
-        if isneg != (ord(rhs._buffer[-1]) & 0x80):
-            return not(isneg)
-        # compute the unsigned (not absolute!) >
-        lmsb = ord(self._buffer[1]) & 0x7f
-        rmsb = ord(rhs._buffer[1]) & 0x7f
-        if lmsb > rmsb:
-            return True
-        elif lmsb < rmsb:
-            return False
-        return ord(self._buffer[0]) > ord(rhs._buffer[0])
+        return _SIGNED.unpack_from(self._buffer)[0] > _SIGNED.unpack_from(rhs._buffer)[0]
 
     def eq(self, rhs):
         """Equals."""
@@ -397,6 +404,8 @@ class Integer(Number):
 class Float(Number):
     """Abstract base class for floating-point value."""
 
+    __slots__ = ()
+
     digits = None
     pos_max = None
     neg_max = None
@@ -425,7 +434,7 @@ class Float(Number):
 
     def to_integer(self, unsigned=False):
         """Convert Float to Integer."""
-        return Integer(None, self._values).from_int(self.to_int(), unsigned)
+        return self._values.new_integer().from_int(self.to_int(), unsigned)
 
     # Python float conversions
 
@@ -534,7 +543,7 @@ class Float(Number):
             return self.gt(self.new().from_integer(rhs))
         elif isinstance(rhs, Double) and isinstance(self, Single):
             # upgrade to Double
-            return Double(None, self._values).from_single(self).gt(rhs)
+            return self._values.new_double().from_single(self).gt(rhs)
         rhsneg = rhs.is_negative()
         # treat zero separately to avoid comparing different mantissas
         # zero is only greater than negative
@@ -554,7 +563,7 @@ class Float(Number):
             return self.eq(self.new().from_integer(rhs))
         elif isinstance(rhs, Double) and isinstance(self, Single):
             # upgrade to Double
-            return Double(None, self._values).from_single(self).eq(rhs)
+            return self._values.new_double().from_single(self).eq(rhs)
         # all zeroes are equal
         if self.is_zero():
             return rhs.is_zero()
@@ -1023,6 +1032,8 @@ class Float(Number):
 class Single(Float):
     """Single-precision MBF float."""
 
+    __slots__ = ()
+
     sigil = b'!'
     size = 4
 
@@ -1067,7 +1078,7 @@ class Single(Float):
 
     def to_double(self):
         """Convert single to double."""
-        return Double(None, self._values).from_single(self)
+        return self._values.new_double().from_single(self)
 
     def to_float(self, allow_double=True):
         """Convert single to float."""
@@ -1080,6 +1091,8 @@ class Single(Float):
 class Double(Float):
     """Double-precision MBF float."""
 
+    __slots__ = ()
+
     sigil = b'#'
     size = 8
 
@@ -1127,7 +1140,7 @@ class Double(Float):
     def to_single(self):
         """Round double to single."""
         mybytes = self.to_bytes()
-        single = Single(None, self._values).from_bytes(mybytes[4:])
+        single = self._values.new_single().from_bytes(mybytes[4:])
         exp, man, neg = single._denormalise()
         # carry byte
         man += mybytes[3]
@@ -1144,6 +1157,98 @@ class Double(Float):
         return self.to_single()
 
 
+##############################################################################
+# floating-point numbers with integer arithmetic
+
+class _IntFloat(object):
+    """Mixin for MBF floats that unpack to a single Python int for arithmetic."""
+
+    __slots__ = ()
+
+    # the whole MBF value as one unsigned integer; exponent in the top byte
+    _word = None
+    _exp_shift = None
+
+    def gt(self, rhs):
+        """Greater than."""
+        if rhs.__class__ is not self.__class__:
+            return super(_IntFloat, self).gt(rhs)
+        lword = self._word.unpack_from(self._buffer)[0]
+        rword = self._word.unpack_from(rhs._buffer)[0]
+        lneg, rneg = lword & self._signmask, rword & self._signmask
+        # zero is only greater than negative
+        if not lword >> self._exp_shift:
+            return bool(rneg) and bool(rword >> self._exp_shift)
+        if lneg != rneg:
+            return not lneg
+        # with equal signs, we can compare floats as if they were ints
+        if lneg:
+            return bool(rword >> self._exp_shift) and rword > lword
+        return lword > rword
+
+    def _abs_gt(self, rhs):
+        """Absolute values greater than."""
+        lword = self._word.unpack_from(self._buffer)[0]
+        # don't compare zeroes
+        if not lword >> self._exp_shift:
+            return False
+        rword = self._word.unpack_from(rhs._buffer)[0]
+        # so long as the sign is the same we can compare floats as if they were ints
+        if not lword & self._signmask:
+            rword &= ~self._signmask
+        return lword > rword
+
+    def _denormalise(self):
+        """Denormalise to shifted mantissa, exp, sign."""
+        word = self._word.unpack_from(self._buffer)[0]
+        man = ((word << 8) & (self._den_upper - 1)) | self._den_mask
+        return word >> self._exp_shift, man, bool(word & self._signmask)
+
+    def _normalise(self, exp, man, neg):
+        """Normalise from shifted mantissa, exp, sign."""
+        # zero denormalised mantissa -> make zero
+        if man == 0 or exp <= 0:
+            self._word.pack_into(self._buffer, 0, 0)
+            return self
+        # shift left if subnormal
+        while man < (self._den_mask-1):
+            exp -= 1
+            man <<= 1
+        # round to nearest; halves to even (Gaussian rounding)
+        round_up = (man & 0xff > 0x80) or (man & 0xff == 0x80 and man & 0x100 == 0x100)
+        man = (man & self._carrymask) + 0x100 * round_up
+        if man >= self._den_upper:
+            exp += 1
+            man >>= 1
+        if exp > 255:
+            self.from_bytes(self.neg_max if neg else self.pos_max)
+            raise OverflowError(self)
+        word = (man>>8) & (self._mask if neg else self._posmask)
+        # on underflow, set to zero, but leave mantissa as is
+        if exp > 0:
+            word |= exp << self._exp_shift
+        self._word.pack_into(self._buffer, 0, word)
+        return self
+
+
+class IntSingle(_IntFloat, Single):
+    """Single-precision MBF float with integer arithmetic."""
+
+    __slots__ = ()
+
+    _word = struct.Struct('<L')
+    _exp_shift = 24
+
+
+class IntDouble(_IntFloat, Double):
+    """Double-precision MBF float with integer arithmetic."""
+
+    __slots__ = ()
+
+    _word = struct.Struct('<Q')
+    _exp_shift = 56
+
+
 ##############################################################################
 # convert string representation to float
 
@@ -6,7 +6,9 @@ String values
 This file is released under the GNU GPL version 3 or later.
 """
 
+import sys
 import struct
+import array
 import logging
 from operator import itemgetter
 
@@ -14,9 +16,37 @@ from ..base import error
 from . import numbers
 
 
+# string pointer: length byte and little-endian address
+_POINTER = struct.Struct('<BH')
+
+
+def _unpack_pointers(buf):
+    """Decode a buffer of string pointers into a bytearray of lengths and an array of addresses."""
+    lengths = buf[0::3]
+    pairs = bytearray(2 * len(lengths))
+    pairs[0::2] = buf[1::3]
+    pairs[1::2] = buf[2::3]
+    addrs = array.array('H', bytes(pairs))
+    if sys.byteorder == 'big':
+        addrs.byteswap()
+    return lengths, addrs
+
+def _pack_pointers(buf, lengths, addrs):
+    """Encode lengths and addresses into a buffer of string pointers."""
+    if sys.byteorder == 'big':
+        addrs = array.array('H', addrs)
+        addrs.byteswap()
+    pairs = addrs.tostring()
+    buf[0::3] = lengths
+    buf[1::3] = pairs[0::2]
+    buf[2::3] = pairs[1::2]
+
+
 class String(numbers.Value):
     """String pointer."""
 
+    __slots__ = ('_stringspace',)
+
     sigil = '$'
     size = 3
 
@@ -130,13 +160,13 @@ class String(numbers.Value):
 
     def len(self):
         """LEN: length of string."""
-        return numbers.Integer(None, self._values).from_int(self.length())
+        return self._values.new_integer().from_int(self.length())
 
     def asc(self):
         """ASC: ordinal ASCII value of a character."""
         s = self.to_str()
         error.throw_if(not s)
-        return numbers.Integer(None, self._values).from_int(ord(s[0]))
+        return self._values.new_integer().from_int(ord(s[0]))
 
     def space(self, num):
         """SPACE$: repeat spaces."""
@@ -152,6 +182,8 @@ class StringSpace(object):
         """Initialise empty string space."""
         self._memory = memory
         self._strings = {}
+        # addresses of stored strings, highest first (the order of storage)
+        self._addresses = []
         self._temp = None
         self.clear()
 
@@ -162,6 +194,7 @@ class StringSpace(object):
     def clear(self):
         """Empty string space."""
         self._strings.clear()
+        del self._addresses[:]
         # strings are placed at the top of string memory, just below the stack
         self.current = self._memory.stack_start()
 
@@ -169,6 +202,7 @@ class StringSpace(object):
         """Rebuild from stored copy."""
         self.clear()
         self._strings.update(stringspace._strings)
+        self._addresses[:] = stringspace._addresses
         self.current = stringspace.current
 
     def copy_to(self, string_space, length, address):
@@ -228,6 +262,7 @@ class StringSpace(object):
             if length > 0:
                 # copy and convert to bytearray
                 self._strings[address] = bytearray(in_str)
+                self._addresses.append(address)
         return length, address
 
     def _delete_last(self):
@@ -237,6 +272,7 @@ class StringSpace(object):
             length = len(self._strings[last_address])
             self.current += length
             del self._strings[last_address]
+            self._addresses.pop()
         except KeyError:
             # happens if we're called before an out-of-memory exception is handled
             # and the string wasn't allocated
@@ -244,44 +280,107 @@ class StringSpace(object):
 
     def collect_garbage(self, string_ptrs):
         """Re-store the strings referenced in string_ptrs, delete the rest."""
-        # string_ptrs should be a list of memoryviews to the original pointers
-        # retrieve addresses and copy strings
+        # string_ptrs should be a list of writeable buffers holding string pointers:
+        # a single pointer for scalars and stack values, all elements for string arrays
+        # retrieve addresses of referenced strings
         string_list = []
-        # find last non-temporary string
-        last_permanent = self._memory.stack_start()
-        last_perm_view = None
-        for view in string_ptrs:
-            length, addr = struct.unpack('<BH', view.tobytes())
+        # decoded pointers of string arrays, by index in string_ptrs
+        tables = {}
+        var_start = self._memory.var_start()
+        for number, buf in enumerate(string_ptrs):
             # exclude empty elements of string arrays (len==0 and addr==0)
             # exclude strings is not located in memory (FIELD or code strings)
-            if addr >= self._memory.var_start():
-                string_list.append((view, addr, self._retrieve(length, addr)))
-                if self._temp is not None:
-                    if addr > self._temp and addr < last_permanent:
-                        last_permanent, last_perm_view = addr, view
+            if len(buf) == 3:
+                length, addr = _POINTER.unpack_from(buf)
+                if addr >= var_start:
+                    string_list.append((addr, length, (number, 0)))
+            else:
+                lengths, addrs = tables[number] = _unpack_pointers(buf)
+                string_list.extend(
+                    (addr, lengths[i], (number, i))
+                    for i, addr in enumerate(addrs) if addr >= var_start)
+        # find last non-temporary string
+        last_permanent = self._memory.stack_start()
+        last_perm_ptr = None
+        if self._temp is not None:
+            for addr, _, ptr in string_list:
+                if addr > self._temp and addr < last_permanent:
+                    last_permanent, last_perm_ptr = addr, ptr
         # sort by address, largest first (maintain order of storage)
-        string_list.sort(key=itemgetter(1), reverse=True)
-        # clear the string buffer and re-store all referenced strings
-        self.clear()
-        for view, _, string in string_list:
-            # re-allocate string space
-            # update the original pointers supplied (these are memoryviews)
-            view[:] = struct.pack('<BH', *self.store(string, check_free=False))
+        string_list.sort(key=itemgetter(0), reverse=True)
+        # the result is the same as re-storing all referenced strings into an empty string space
+        # but the strings at the top that are already in place are left alone:
+        # only strings below the first unreferenced or multiply referenced string are moved
+        current = self._memory.stack_start()
+        kept, stored = 0, 0
+        for addr, length, _ in string_list:
+            if addr != current - length + 1 or length and len(self._strings[addr]) != length:
+                break
+            current -= length
+            kept += 1
+            stored += length > 0
+        moved = [(ptr, self._retrieve(length, addr)) for addr, length, ptr in string_list[kept:]]
+        # delete the strings below the ones kept in place; these are unreferenced or moved
+        for addr in self._addresses[stored:]:
+            del self._strings[addr]
+        del self._addresses[stored:]
+        self.current = current
+        # re-allocate string space and update the pointers supplied
+        changed = set()
+        for (number, i), string in moved:
+            length, addr = self.store(string, check_free=False)
+            if number in tables:
+                lengths, addrs = tables[number]
+                lengths[i], addrs[i] = length, addr
+                changed.add(number)
+            else:
+                _POINTER.pack_into(string_ptrs[number], 0, length, addr)
+        for number in changed:
+            _pack_pointers(string_ptrs[number], *tables[number])
         # readdress  start of temporary strings
-        if last_perm_view is None:
+        if last_perm_ptr is None:
             self._temp = None
         elif self._temp is not None and self._temp != self._memory.stack_start():
-            self._temp = -1 + struct.unpack_from('<H', last_perm_view.tobytes(), 1)[0]
+            number, i = last_perm_ptr
+            self._temp = -1 + _POINTER.unpack_from(string_ptrs[number], 3*i)[1]
+
+    def _find(self, address):
+        """Return the index of the highest stored string starting at or below an address."""
+        # addresses are in descending order
+        lo, hi = 0, len(self._addresses)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._addresses[mid] > address:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
 
     def get_memory(self, address):
         """Retrieve data from data memory: string space """
-        # find the variable we're in
-        for try_address, value in self._strings.iteritems():
-            length = len(value)
-            if try_address <= address < try_address + length:
-                return value[address - try_address]
+        # find the string we're in
+        index = self._find(address)
+        if index < len(self._addresses):
+            start = self._addresses[index]
+            value = self._strings[start]
+            if address < start + len(value):
+                return value[address - start]
         return -1
 
+    def get_memory_block(self, address, length):
+        """Retrieve a block of data from data memory: string space """
+        block = bytearray(length)
+        end = address + length
+        # strings starting below the end of the block, from the highest down
+        for index in xrange(self._find(end - 1), len(self._addresses)):
+            start = self._addresses[index]
+            value = self._strings[start]
+            if start + len(value) <= address:
+                break
+            lo, hi = max(address, start), min(end, start + len(value))
+            block[lo-address:hi-address] = value[lo-start:hi-start]
+        return block
+
     def fix_temporaries(self):
         """Make all temporary strings permanent."""
         self._temp = self.current
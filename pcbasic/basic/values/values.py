@@ -35,6 +35,12 @@ SIZE_TO_TYPE = {2: INT, 3: STR, 4: SNG, 8: DBL}
 SIZE_TO_CLASS = {2: numbers.Integer, 3: strings.String, 4: numbers.Single, 8: numbers.Double}
 TYPE_TO_CLASS = {INT: numbers.Integer, STR: strings.String, SNG: numbers.Single, DBL: numbers.Double}
 
+# Single and Double classes for each float engine
+FLOAT_ENGINES = {
+    u'buffer': (numbers.Single, numbers.Double),
+    u'int': (numbers.IntSingle, numbers.IntDouble),
+}
+
 
 def size_bytes(name):
     """Return the size of a value type, by variable name or type char."""
@@ -116,11 +122,11 @@ def _call_float_function(fn, *args):
         return floatcls(None, values).from_value(fn(*args))
     except (ValueError, ArithmeticError) as e:
         # create positive infinity of the appropriate class
-        if arg._values.double_math and isinstance(args[0], numbers.Double):
-            floatcls = numbers.Double
+        if values.double_math and isinstance(args[0], numbers.Double):
+            infty = values.new_double()
         else:
-            floatcls = numbers.Single
-        infty = floatcls(None, values).from_bytes(floatcls.pos_max)
+            infty = values.new_single()
+        infty.from_bytes(infty.pos_max)
         # attach as exception payload for float error handler to deal with
         return feh.handle(e.__class__(infty))
 
@@ -131,9 +137,10 @@ class FloatErrorHandler(object):
     # types of errors that do not always interrupt execution
     soft_types = (error.OVERFLOW, error.DIVISION_BY_ZERO)
 
-    def __init__(self, screen):
+    def __init__(self, screen, values):
         """Setup handler."""
         self._screen = screen
+        self._values = values
         self._do_raise = False
 
     def suspend(self, do_raise):
@@ -166,7 +173,7 @@ class FloatErrorHandler(object):
             elif isinstance(e.args[0], numbers.Integer):
                 # integer values are not soft-handled
                 raise error.BASICError(math_error)
-        return numbers.Single(None, self).from_bytes(numbers.Single.pos_max)
+        return self._values.new_single().from_bytes(numbers.Single.pos_max)
 
 
 ###############################################################################
@@ -174,40 +181,80 @@ class FloatErrorHandler(object):
 class Values(object):
     """Handles BASIC strings and numbers."""
 
-    def __init__(self, string_space, double_math):
+    def __init__(self, string_space, double_math, float_engine=u'buffer'):
         """Setup values."""
         self.stringspace = string_space
         # double-precision EXP, SIN, COS, TAN, ATN, LOG
         self.double_math = double_math
+        # float arithmetic on byte buffers or on integers
+        try:
+            self._single, self._double = FLOAT_ENGINES[float_engine]
+        except KeyError:
+            raise ValueError('%s is not a valid float engine.' % float_engine)
+        self._size_to_class = dict(SIZE_TO_CLASS)
+        self._size_to_class.update({4: self._single, 8: self._double})
+        self._type_to_class = dict(TYPE_TO_CLASS)
+        self._type_to_class.update({SNG: self._single, DBL: self._double})
+        # free-lists of recycled temporaries, by class
+        self._free = dict((cls, []) for cls in self._type_to_class.values())
+        # shared read-only values for number literals, by token
+        self._literals = {}
+
+    def __getstate__(self):
+        """Pickle."""
+        pickle_dict = self.__dict__.copy()
+        # recycled temporaries and decoded literals are not state
+        pickle_dict['_free'] = dict((cls, []) for cls in self._free)
+        pickle_dict['_literals'] = {}
+        return pickle_dict
 
     def set_screen(self, screen):
         """Initialise the error message screen."""
-        self.error_handler = FloatErrorHandler(screen)
+        self.error_handler = FloatErrorHandler(screen, self)
+        # recycled numbers and literals hold on to the error handler they were created with
+        for free in self._free.itervalues():
+            del free[:]
+        self._literals.clear()
+
+    def allocate(self, cls):
+        """Return a value of the given class with zeroed buffer, recycled if possible."""
+        free = self._free[cls]
+        if free:
+            value = free.pop()
+            value._buffer[:] = b'\0' * cls.size
+            return value
+        return cls(None, self)
+
+    def recycle(self, value):
+        """Take back a temporary that is no longer referenced."""
+        # views on variable memory are never recycled
+        if value._owned:
+            self._free[value.__class__].append(value)
 
     def create(self, buf):
         """Create new variable object with buffer provided."""
         # this sets a view, not a copy
-        return SIZE_TO_CLASS[len(buf)](buf, self)
+        return self._size_to_class[len(buf)](buf, self)
 
     def new(self, sigil):
         """Return newly allocated value of the given type with zeroed buffer."""
-        return TYPE_TO_CLASS[sigil](None, self)
+        return self.allocate(self._type_to_class[sigil])
 
     def new_string(self):
         """Return newly allocated null string."""
-        return strings.String(None, self)
+        return self.allocate(strings.String)
 
     def new_integer(self):
         """Return newly allocated zero integer."""
-        return numbers.Integer(None, self)
+        return self.allocate(numbers.Integer)
 
     def new_single(self):
         """Return newly allocated zero single."""
-        return numbers.Single(None, self)
+        return self.allocate(self._single)
 
     def new_double(self):
         """Return newly allocated zero double."""
-        return numbers.Double(None, self)
+        return self.allocate(self._double)
 
     ###########################################################################
     # convert between BASIC and Python values
@@ -215,18 +262,18 @@ class Values(object):
     @float_safe
     def from_value(self, python_val, typechar):
         """Convert Python value to BASIC value."""
-        return TYPE_TO_CLASS[typechar](None, self).from_value(python_val)
+        return self.allocate(self._type_to_class[typechar]).from_value(python_val)
 
     def from_str_at(self, python_str, address):
         """Convert str to String at given address."""
-        return strings.String(None, self).from_pointer(
+        return self.allocate(strings.String).from_pointer(
             *self.stringspace.store(python_str, address))
 
     def from_bool(self, boo):
         """Convert Python boolean to Integer."""
         if boo:
-            return numbers.Integer(None, self).from_bytes('\xff\xff')
-        return numbers.Integer(None, self)
+            return self.allocate(numbers.Integer).from_bytes('\xff\xff')
+        return self.allocate(numbers.Integer)
 
     ###########################################################################
     # convert to and from internal representation
@@ -234,7 +281,7 @@ class Values(object):
     def from_bytes(self, token_bytes):
         """Convert internal byte representation to BASIC value."""
         # make a copy, not a view
-        return SIZE_TO_CLASS[len(token_bytes)](None, self).from_bytes(token_bytes)
+        return self.allocate(self._size_to_class[len(token_bytes)]).from_bytes(token_bytes)
 
     def from_token(self, token):
         """Convert number token to new Number temporary"""
@@ -242,13 +289,24 @@ class Values(object):
             raise ValueError('Token must not be empty')
         lead = bytes(token)[0]
         if lead == tk.T_SINGLE:
-            return numbers.Single(None, self).from_token(token)
+            return self.allocate(self._single).from_token(token)
         elif lead == tk.T_DOUBLE:
-            return numbers.Double(None, self).from_token(token)
+            return self.allocate(self._double).from_token(token)
         elif lead in tk.NUMBER:
-            return numbers.Integer(None, self).from_token(token)
+            return self.allocate(numbers.Integer).from_token(token)
         raise ValueError('%s is not a number token' % repr(token))
 
+    def literal(self, token):
+        """Return a shared, read-only number for a number token."""
+        token = bytes(token)
+        try:
+            return self._literals[token]
+        except KeyError:
+            # the buffer can't be written to, so in-place operations raise TypeError
+            # anything that modifies its operand must work on a copy
+            value = self.create(bytes(self.from_token(token).to_bytes()))
+            return self._literals.setdefault(token, value)
+
     ###########################################################################
     # create value from string representations
 
@@ -286,7 +344,7 @@ class Values(object):
 @float_safe
 def round(x):
     """Round to nearest whole number without converting to int."""
-    return x.to_float().iround()
+    return x.to_float().clone().iround()
 
 
 ###############################################################################
@@ -387,12 +445,14 @@ def cvd_(args):
 
 def _bool_eq(left, right):
     """Return true if left == right, false otherwise."""
-    left, right = match_types(left, right)
+    if not (isinstance(left, numbers.Integer) and isinstance(right, numbers.Integer)):
+        left, right = match_types(left, right)
     return left.eq(right)
 
 def _bool_gt(left, right):
     """Ordering: return -1 if left > right, 0 otherwise."""
-    left, right = match_types(left, right)
+    if not (isinstance(left, numbers.Integer) and isinstance(right, numbers.Integer)):
+        left, right = match_types(left, right)
     return left.gt(right)
 
 def eq(left, right):
@@ -481,7 +541,7 @@ def neg(inp):
 def sgn_(args):
     """Sign."""
     x, = args
-    return numbers.Integer(None, x._values).from_int(pass_number(x).sign())
+    return x._values.new_integer().from_int(pass_number(x).sign())
 
 def int_(args):
     """Truncate towards negative infinity (INT)."""
@@ -652,7 +712,7 @@ def instr_(args):
         big = pass_string(arg0)
     small = pass_string(next(args))
     list(args)
-    new_int = numbers.Integer(None, big._values)
+    new_int = big._values.new_integer()
     big = big.to_str()
     small = small.to_str()
     if big == '' or start > len(big):
@@ -678,7 +738,7 @@ def string_(args):
         ascval = asc_value_or_char.to_integer().to_int()
         error.range_check(0, 255, ascval)
         char = chr(ascval)
-    return strings.String(None, asc_value_or_char._values).from_str(char * num)
+    return asc_value_or_char._values.new_string().from_str(char * num)
 
 ##############################################################################
 # binary operations
@@ -690,7 +750,7 @@ def pow(left, right):
             isinstance(left, numbers.Double) or isinstance(right, numbers.Double)):
         return _call_float_function(lambda a, b: a**b, left.to_double(), right.to_double())
     elif isinstance(right, numbers.Integer):
-        return left.to_single().ipow_int(right)
+        return left.to_single().clone().ipow_int(right)
     else:
         return _call_float_function(lambda a, b: a**b, left.to_single(), right.to_single())
 
@@ -266,11 +266,15 @@ class Settings(object):
         u'load': {u'type': u'string', u'default': u'', },
         u'run': {u'type': u'string', u'default': u'',  },
         u'convert': {u'type': u'string', u'default': u'', },
+        u'compile': {u'type': u'bool', u'default': False, },
+        u'use-compiled': {u'type': u'bool', u'default': False, },
         u'help': {u'type': u'bool', u'default': False, },
         u'keys': {u'type': u'string', u'default': u'', },
         u'exec': {u'type': u'string', u'default': u'', },
         u'quit': {u'type': u'bool', u'default': False,},
         u'double': {u'type': u'bool', u'default': False,},
+        u'float-engine': {u'type': u'string', u'choices': (u'buffer', u'int'), u'default': u'buffer',},
+        u'compile-loops': {u'type': u'int', u'default': 0,},
         u'max-files': {u'type': u'int', u'default': 3,},
         u'max-reclen': {u'type': u'int', u'default': 128,},
         u'serial-buffer-size': {u'type': u'int', u'default': 256,},
@@ -477,6 +481,8 @@ class Settings(object):
             'pcjr_term': pcjr_term,
             'shell': self.get('shell'),
             'double': self.get('double'),
+            'float_engine': self.get('float-engine'),
+            'compile_loops': self.get('compile-loops'),
             # device settings
             'device_params': device_params,
             'current_device': current_device,
@@ -563,9 +569,11 @@ class Settings(object):
                 commands.append('RUN')
             if self.get('quit'):
                 commands.append('SYSTEM')
+        prog = self.get(0) or self.get('run') or self.get('load')
         launch_params = {
             'wait': self.get('wait'),
-            'prog': self.get(0) or self.get('run') or self.get('load'),
+            'prog': prog,
+            'compiled': self._get_compiled_name(prog) if self.get('use-compiled') else u'',
             'resume': self.get('resume'),
             'state_file': self.get_state_file(),
             'commands': commands,
@@ -649,6 +657,19 @@ class Settings(object):
         name_out = self.get(1)
         return mode, name_in, name_out
 
+    def get_compiler_parameters(self):
+        """Get parameters for compilation to a Python module."""
+        # first arg, if given, is the program; second arg, if given, is the module
+        name_in = (self.get(0) or self.get('run') or self.get('load'))
+        name_out = self.get(1) or self._get_compiled_name(name_in)
+        return name_in, name_out
+
+    def _get_compiled_name(self, prog):
+        """Get the name of the compiled module for a program; it is kept next to the program."""
+        if not prog:
+            return u''
+        return os.path.splitext(prog)[0] + u'.pcbc.py'
+
     def get_command(self):
         """Get operating mode."""
         if self.get('version'):
@@ -658,6 +679,8 @@ class Settings(object):
             return 'help'
         elif self.get('convert'):
             return 'convert'
+        elif self.get('compile'):
+            return 'compile'
         return None
 
     def _get_arguments(self, argv):
@@ -64,6 +64,9 @@ def run(*arguments):
         elif command == 'convert':
             # convert and exit
             convert(settings)
+        elif command == 'compile':
+            # compile to python and exit
+            compile_program(settings)
         elif settings.get_interfaces():
             # start an interpreter session with interface
             launch_session(settings)
@@ -124,6 +127,16 @@ def convert(settings):
     except basic.BASICError as e:
         logging.error(e.message)
 
+def compile_program(settings):
+    """Compile program to a Python module."""
+    name_in, name_out = settings.get_compiler_parameters()
+    session = basic.Session(**settings.get_session_parameters())
+    try:
+        session.load_program(name_in)
+        session.compile_program(name_out)
+    except basic.BASICError as e:
+        logging.error(e.message)
+
 def launch_session(settings):
     """Start an interactive interpreter session."""
     from . import interface
@@ -150,7 +163,7 @@ def launch_session(settings):
         thread.join()
 
 def run_session(iface=None, resume=False, state_file=None, wait=False,
-                prog=None, commands=(), **session_params):
+                prog=None, compiled=None, commands=(), **session_params):
     """Run an interactive BASIC session."""
     try:
         if resume:
@@ -160,6 +173,8 @@ def run_session(iface=None, resume=False, state_file=None, wait=False,
         try:
             if prog:
                 session.load_program(prog)
+                if compiled:
+                    session.load_compiled(compiled)
             for cmd in commands:
                 session.execute(cmd)
             session.interact()
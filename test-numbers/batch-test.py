@@ -0,0 +1,126 @@
+
+import sys
+import os
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcbasic.basic.values import batch
+from pcbasic.basic.values import values
+
+import numpy
+
+
+def read_words(name):
+    with open(name, 'rb') as f:
+        return batch.from_bytes(f.read(), 4)
+
+def check(name, out, model):
+    """Compare output against model file; return number of mismatches."""
+    with open(model, 'rb') as h:
+        expected = batch.from_bytes(h.read(), 4)
+    bad = numpy.flatnonzero(out != expected)
+    for i in bad:
+        print '%08x %08x' % (out[i], expected[i])
+    print '%-12s %d/%d' % (name, len(out) - len(bad), len(out))
+    return len(bad)
+
+def previous(words):
+    """Each word paired with its predecessor; the first with zero."""
+    return numpy.concatenate(([0], words[:-1])).astype(words.dtype)
+
+def scalar(op, left, right):
+    """Apply a scalar operation to pairs of words; return results and error mask."""
+    vm = values.Values(None, False)
+    vm.set_screen(None)
+    size = left.dtype.itemsize
+    lbytes, rbytes = batch.to_bytes(left), batch.to_bytes(right)
+    results, errors = [], []
+    for i in xrange(0, len(lbytes), size):
+        lval = vm.create(bytearray(lbytes[i:i+size]))
+        rval = vm.create(bytearray(rbytes[i:i+size]))
+        try:
+            result = getattr(lval, op)(rval)
+            errors.append(False)
+        except (OverflowError, ZeroDivisionError):
+            result = lval
+            errors.append(True)
+        results.append(result if isinstance(result, bool) else bytes(result.to_bytes()))
+    if results and isinstance(results[0], bool):
+        return numpy.array(results, dtype=bool), numpy.array(errors, dtype=bool)
+    return batch.from_bytes(b''.join(results), size), numpy.array(errors, dtype=bool)
+
+def check_scalar(name, left, right):
+    """Compare all batch operations against the scalar ones; return number of mismatches."""
+    failures = 0
+    for op, fn in (
+            ('iadd', batch.add), ('isub', batch.sub), ('imul', batch.mul),
+            ('idiv', batch.div), ('gt', batch.gt), ('eq', batch.eq)):
+        expected, expected_errors = scalar(op, left, right)
+        out = fn(left, right)
+        if op in ('gt', 'eq'):
+            out, errors = out, numpy.zeros(len(out), dtype=bool)
+        else:
+            out, errors = out
+        bad = numpy.flatnonzero((out != expected) | (errors != expected_errors))
+        for i in bad[:10]:
+            print '    %x %x: %s %s, expected %s %s' % (
+                left[i], right[i], out[i], errors[i], expected[i], expected_errors[i])
+        print '%-16s %d/%d %d errors' % (
+            '%s-%s' % (name, op), len(out) - len(bad), len(out), numpy.count_nonzero(expected_errors))
+        failures += len(bad)
+    return failures
+
+
+if __name__ == '__main__':
+    start = time.clock()
+    failures = 0
+
+    print 'allbytes'
+    allword = read_words('input/ALLWORD.DAT')
+    left = (allword & 0xff) | 0x80000000
+    right = ((allword >> 8) & 0xff) | 0x80000000
+    failures += check('add', batch.add(left, right)[0], 'model/GWBASABY.DAT')
+    failures += check('sub', batch.sub(left, right)[0], 'model/GWBASSBY.DAT')
+
+    print 'allshifts'
+    right = (allword & 0xffff) | 0x80000000
+    for shift in [0,]+range(9, 11):
+        letter = chr(ord('0')+shift) if shift<10 else chr(ord('A')-10+shift)
+        left = (previous(right) & 0xffff) | ((0x80+shift) << 24)
+        failures += check(letter, batch.add(left, right)[0], 'model/GWBASAL'+letter+'.DAT')
+
+    print 'lowshifts'
+    right = (read_words('input/BYTES.DAT') & 0xffff) | 0x80000000
+    for shift in range(17):
+        letter = chr(ord('0')+shift) if shift<10 else chr(ord('A')-10+shift)
+        left = (previous(right) & 0xffff) | ((0x80+shift) << 24)
+        failures += check(letter, batch.add(left, right)[0], 'model/GWBASLO'+letter+'.DAT')
+
+    print 'bytes'
+    right = read_words('input/BYTES.DAT')
+    failures += check('add', batch.add(previous(right), right)[0], 'model/GWBASADD.DAT')
+
+    print 'bigbytes'
+    right = read_words('input/BIGBYTES.DAT')
+    failures += check('add', batch.add(previous(right), right)[0], 'model/GWBIGADD.DAT')
+    failures += check('mul', batch.mul(previous(right), right)[0], 'model/GWBIGMUL.DAT')
+
+    print 'scalar'
+    # exponents of the right operand run through all values, including zero
+    right = (allword >> 8) | (allword << 24)
+    failures += check_scalar('allwords', allword, right)
+    # maximal exponents overflow on addition
+    left = allword | 0xff000000
+    failures += check_scalar('maxwords', left, previous(left))
+    right = read_words('input/BIGBYTES.DAT')
+    # every sixteenth right operand is zero
+    right = numpy.where(numpy.arange(len(right)) % 16 == 0, 0, right).astype(right.dtype)
+    failures += check_scalar('single', previous(right), right)
+    with open('input/BIGBYTES.DAT', 'rb') as f:
+        right = batch.from_bytes(f.read(), 8)
+    right = numpy.where(numpy.arange(len(right)) % 16 == 0, 0, right).astype(right.dtype)
+    failures += check_scalar('double', previous(right), right)
+    left = right | numpy.uint64(0xff00000000000000)
+    failures += check_scalar('maxdouble', left, previous(left))
+
+    print '%d failures in %.3fs' % (failures, time.clock() - start)
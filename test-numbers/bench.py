@@ -0,0 +1,188 @@
+"""
+PC-BASIC performance benchmarks
+
+usage: python bench.py [benchmark [count]]
+Runs the given benchmark, or all of them, and prints the time taken by each variant.
+"""
+
+import sys
+import os
+import time
+import tempfile
+import shutil
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcbasic.basic import Session
+from pcbasic.basic.values import values
+from pcbasic.basic.values import numbers
+
+
+def run_program(program, count, module=None, **session_params):
+    """Run a BASIC program in a new session; return the session and the time taken by RUN."""
+    with Session(**session_params) as s:
+        for line in program:
+            s.execute(line % count if '%' in line else line)
+        if module:
+            s.compile_program(module)
+            s.load_compiled(module)
+        start = time.clock()
+        s.execute('RUN')
+        return s, time.clock() - start
+
+def timed(fn, *args):
+    """Return the time taken by a function."""
+    start = time.clock()
+    fn(*args)
+    return time.clock() - start
+
+
+##############################################################################
+# integer arithmetic
+
+INTEGER_PROGRAM = (
+    '10 DEFINT A-Z: M=&H5555',
+    '20 FOR I=1 TO %d: J=I AND M: K=J XOR I: L=(K>J): NEXT',
+)
+
+def _counter_ops(vm, count):
+    one = vm.new_integer().from_int(1)
+    top = vm.new_integer().from_int(count)
+    counter = vm.new_integer().from_int(-count)
+    while not counter.gt(top):
+        counter.iadd(one)
+        counter.isub(one).iadd(one).ineg().ineg()
+
+def _integer_ops(vm, count):
+    one = vm.new_integer().from_int(1)
+    mask = vm.new_integer().from_int(0x5555)
+    top = vm.new_integer().from_int(count)
+    counter = vm.new_integer()
+    while not counter.gt(top):
+        counter.iadd(one)
+        values.and_(counter, mask)
+        values.xor_(counter, mask)
+        values.eq(counter, mask)
+
+def integer(count):
+    """Integer operations on value objects and in a BASIC loop."""
+    vm = values.Values(None, False)
+    vm.set_screen(None)
+    yield 'counter', timed(_counter_ops, vm, count), ''
+    yield 'operations', timed(_integer_ops, vm, count), ''
+    yield 'for-loop', run_program(INTEGER_PROGRAM, count)[1], ''
+
+
+##############################################################################
+# value allocation
+
+# each loop iteration executes this many statements, including NEXT
+ALLOC_STATEMENTS = 5
+ALLOC_PROGRAM = (
+    '10 DEFINT I: A=1.5: B#=2: C$="abc"',
+    '20 FOR I=1 TO %d: X=A*I+B#/2-(A+1)*(B#-3): Y=X*X-2*X+1: Z=-(A+I)^2',
+    '30 D$=C$+"x"+C$: NEXT',
+)
+
+def alloc(count):
+    """Expression evaluation with and without recycling of temporaries."""
+    allocations = [0]
+    value_init = numbers.Value.__init__
+    recycle = values.Values.recycle
+
+    def counting_init(self, buffer, vals):
+        if buffer is None:
+            allocations[0] += 1
+        value_init(self, buffer, vals)
+
+    numbers.Value.__init__ = counting_init
+    try:
+        for variant, free_list in (('no free-list', False), ('free-list', True)):
+            values.Values.recycle = recycle if free_list else lambda self, value: None
+            allocations[0] = 0
+            seconds = run_program(ALLOC_PROGRAM, count)[1]
+            yield variant, seconds, '%6.2f allocations per statement' % (
+                allocations[0] / float(count * ALLOC_STATEMENTS))
+    finally:
+        numbers.Value.__init__ = value_init
+        values.Values.recycle = recycle
+
+
+##############################################################################
+# compiled loops
+
+LOOP_PROGRAM = (
+    '10 DIM A(100): S=0: T#=0',
+    '20 FOR I=1 TO %d: X=I*0.5: S=S+X*X-3: A(I MOD 100)=S/7',
+    '30 IF I MOD 3 THEN T#=T#+A(I MOD 100) ELSE T#=T#-1',
+    '40 NEXT: PRINT S; T#',
+)
+
+def loop(count):
+    """A FOR loop run by the interpreter and compiled to closures."""
+    yield 'interpreted', run_program(LOOP_PROGRAM, count)[1], ''
+    session, seconds = run_program(LOOP_PROGRAM, count, compile_loops=10)
+    stats = session.interpreter.loop_compiler.get_stats()
+    yield 'compiled', seconds, '; '.join(
+        '[%i] %i statements compiled, %i+%i iterations, %i entries, %i fallbacks' % line
+        for line in stats
+    )
+
+
+##############################################################################
+# compiled programs
+
+COMPILE_PROGRAM = (
+    '10 DIM A(100): S=0: T#=0: I=0',
+    '20 I=I+1: X=I*0.5: S=S+X*X-3: A(I MOD 100)=S/7',
+    '30 IF I MOD 3 THEN T#=T#+A(I MOD 100) ELSE T#=T#-1',
+    '40 B$=LEFT$(STR$(I)+"XYZ",4): GOSUB 100',
+    '50 IF I < %d GOTO 20',
+    '60 PRINT S; T#; B$; C',
+    '70 END',
+    '100 C=C+LEN(B$): RETURN',
+)
+
+def compile_(count):
+    """A program run by the interpreter and through a compiled module."""
+    yield 'interpreted', run_program(COMPILE_PROGRAM, count)[1], ''
+    temp_dir = tempfile.mkdtemp()
+    try:
+        module = os.path.join(temp_dir, 'BENCH.pcbc.py')
+        yield 'compiled', run_program(COMPILE_PROGRAM, count, module=module)[1], ''
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+##############################################################################
+# string garbage collection
+
+GC_PROGRAM = (
+    '10 CLEAR ,23480: DIM A$(2000): FOR I=0 TO 2000: A$(I)=STRING$(6, 65+I MOD 26): NEXT',
+    '20 FOR I=1 TO %d: B$=STR$(I)+A$(I MOD 2000): NEXT',
+    '30 PRINT FRE(0)',
+)
+
+def gc(count):
+    """String churn in a nearly full string space."""
+    yield 'collect', run_program(GC_PROGRAM, count)[1], ''
+
+
+# benchmark functions and default counts, by name
+BENCHMARKS = {
+    'integer': (integer, 30000),
+    'alloc': (alloc, 3000),
+    'loop': (loop, 10000),
+    'compile': (compile_, 10000),
+    'gc': (gc, 3000),
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:2] or sorted(BENCHMARKS)
+    for name in names:
+        bench, count = BENCHMARKS[name]
+        if len(sys.argv) > 2:
+            count = int(sys.argv[2])
+        print '%s (%d)' % (name, count)
+        for variant, seconds, note in bench(count):
+            print ('    %-12s %.3fs %s' % (variant, seconds, note)).rstrip()
@@ -9,7 +9,12 @@ from pcbasic.basic.values.numbers import *
 from pcbasic.basic.values import numbers
 
 if __name__ == '__main__':
-    vm = values.Values(None, None, False)
+    # float engine to test: buffer or int
+    engine = sys.argv[1] if len(sys.argv) > 1 else u'buffer'
+    vm = values.Values(None, False, engine)
+    vm.set_screen(None)
+    if not os.path.isdir('output'):
+        os.mkdir('output')
     for i in range(127,130):
         a = vm.new_single().from_int(i)
         r = vm.new_single().from_int(2**23)
@@ -40,9 +45,9 @@ if __name__ == '__main__':
                         bufl = bytearray(chr(buf[0])+'\0\0'+chr(0x80))
                         bufr = bytearray(chr(buf[1])+'\0\0'+chr(0x80))
 
-                        l = Single(bufl, vm)
+                        l = vm.create(bufl)
                         bufs = str(bufl), str(bufr)
-                        r = Single(bufr, vm)
+                        r = vm.create(bufr)
                         out = str(l.iadd(r).to_bytes())
                         g.write(out)
                         inp = h.read(4)
@@ -63,9 +68,9 @@ if __name__ == '__main__':
                         bufl = bytearray(chr(buf[0])+'\0\0'+chr(0x80))
                         bufr = bytearray(chr(buf[1])+'\0\0'+chr(0x80))
 
-                        l = Single(bufl, vm)
+                        l = vm.create(bufl)
                         bufs = str(bufl), str(bufr)
-                        r = Single(bufr, vm)
+                        r = vm.create(bufr)
                         out = str(l.isub(r).to_bytes())
                         g.write(out)
                         inp = h.read(4)
@@ -89,7 +94,7 @@ if __name__ == '__main__':
                             if len(buf) < 4:
                                 break
                             buf[2:] = '\0\x80'
-                            r = Single(buf, vm)
+                            r = vm.create(buf)
                             ll = l.clone()
                             bufs = str(l.to_bytes()), str(buf)
                             out = str(l.iadd(r).to_bytes())
@@ -119,7 +124,7 @@ if __name__ == '__main__':
                             if len(buf) < 4:
                                 break
                             buf[2:] = '\0\x80'
-                            r = Single(buf, vm)
+                            r = vm.create(buf)
                             ll = l.clone()
                             bufs = str(l.to_bytes()), str(buf)
                             out = str(l.iadd(r).to_bytes())
@@ -141,7 +146,7 @@ if __name__ == '__main__':
                         buf = bytearray(f.read(4))
                         if len(buf) < 4:
                             break
-                        r = Single(buf, vm)
+                        r = vm.create(buf)
                         ll = l.clone()
                         bufs = str(l.to_bytes()), str(buf)
                         out = str(l.iadd(r).to_bytes())
@@ -162,7 +167,7 @@ if __name__ == '__main__':
                         buf = bytearray(f.read(4))
                         if len(buf) < 4:
                             break
-                        r = Single(buf, vm)
+                        r = vm.create(buf)
                         ll = l.clone()
                         bufs = str(l.to_bytes()), str(buf)
                         out = str(l.iadd(r).to_bytes())
@@ -184,7 +189,7 @@ if __name__ == '__main__':
                         buf = bytearray(f.read(4))
                         if len(buf) < 4:
                             break
-                        r = Single(buf, vm)
+                        r = vm.create(buf)
                         ll = l.clone()
                         bufs = str(l.to_bytes()), str(buf)
                         try:
@@ -13,6 +13,7 @@ import filecmp
 import contextlib
 import traceback
 import time
+import ConfigParser
 from copy import copy
 
 
@@ -35,6 +36,17 @@ def count_diff(file1, file2):
             count += 1
     return n, count
 
+def get_compiled_name():
+    """Name of the compiled module the test runs its program through, if any."""
+    config = ConfigParser.RawConfigParser()
+    config.read('PCBASIC.INI')
+    try:
+        if config.getboolean('pcbasic', 'use-compiled'):
+            return os.path.splitext(config.get('pcbasic', 'run'))[0] + '.pcbc.py'
+    except (ConfigParser.Error, ValueError):
+        pass
+    return None
+
 @contextlib.contextmanager
 def suppress_stdio(do_suppress):
     if not do_suppress:
@@ -105,7 +117,15 @@ for name in args:
     with suppress_stdio(do_suppress):
         crash = None
         try:
+            compiled = get_compiled_name()
+            if compiled:
+                # compile the program first; the module is not part of the output
+                pcbasic.run('--interface=none', '--compile')
+                if not os.path.isfile(compiled):
+                    raise EnvironmentError('compiled module %s not written' % compiled)
             pcbasic.run('--interface=none', '--catch-exceptions=basic')
+            if compiled:
+                os.remove(compiled)
         except Exception as e:
             crash = e
             traceback.print_tb(sys.exc_info()[2])